@@ -1,11 +1,20 @@
+import asyncio
+import json
+import os
+import time
+from urllib.parse import urlparse
 from banal import ensure_list
 import httpx
 import fnmatch
-from typing import Annotated, Any, Generator
+from typing import Annotated, Any, BinaryIO, Generator, Iterable
+import orjson
+import yaml
 
-from anystore.decorators import anycache
-from anystore.io import smart_write
+from anystore.exceptions import DoesNotExist
+from anystore.io import smart_open, smart_read
 from anystore.logging import configure_logging
+from anystore.store import get_store
+from anystore.util import clean_dict
 from ftmq.model import Catalog as BaseCatalog, Dataset
 from structlog import get_logger
 import typer
@@ -13,17 +22,207 @@ import typer
 configure_logging()
 log = get_logger("datasets.build_catalog")
 ALEPH_URL = "https://search.openaleph.org/api/2/collections?exclude:category=casefile&facet=countries&facet=category&facet_size:category=1000&facet_size:countries=1000&facet_total:category=true&facet_total:countries=true&limit=30&q={foreign_id}&sort=created_at:desc"
+ALEPH_CONCURRENCY = int(os.environ.get("ALEPH_CONCURRENCY", 10))
+# re-query datasets without aleph collection after this many seconds
+ALEPH_MISS_TTL = int(os.environ.get("ALEPH_MISS_TTL", 7 * 86400))
+CACHE = get_store(serialization_mode="json")
+# local copies of remote catalogs, revalidated (ETag) after this many seconds
+CATALOG_CACHE = get_store(
+    os.environ.get("CATALOG_CACHE_URI", ".cache/catalogs"), serialization_mode="raw"
+)
+CATALOG_CACHE_TTL = int(os.environ.get("CATALOG_CACHE_TTL", 3600))
+CATALOG_CONCURRENCY = int(os.environ.get("CATALOG_CONCURRENCY", 10))
+# (catalog uri, patch, dataset name) -> patched dataset, shared across outputs
+PATCHED_DATASETS: dict[tuple[str, bytes, str], dict[str, Any]] = {}
 
 
-@anycache
-def get_aleph_url(foreign_id: str) -> str | None:
-    res = httpx.get(ALEPH_URL.format(foreign_id=foreign_id))
+def make_aleph_cache_key(foreign_id: str) -> str:
+    return f"build_catalog/aleph/{foreign_id}"
+
+
+def get_cached_aleph_url(foreign_id: str) -> tuple[bool, str | None]:
+    """Look up the aleph url in the cache, misses expire after `ALEPH_MISS_TTL`"""
+    try:
+        res = CACHE.get(make_aleph_cache_key(foreign_id))
+    except DoesNotExist:
+        return False, None
+    if res["url"] is None and time.time() - res["checked_at"] > ALEPH_MISS_TTL:
+        return False, None
+    return True, res["url"]
+
+
+def parse_aleph_url(foreign_id: str, res: httpx.Response) -> str | None:
     if res.status_code == 200:
-        data = res.json()
-        for collection in ensure_list(data["results"]):
+        url = None
+        for collection in ensure_list(res.json()["results"]):
             if collection["foreign_id"] == foreign_id:
                 log.info("Found Aleph collection", foreign_id=foreign_id)
-                return collection["links"]["ui"]
+                url = collection["links"]["ui"]
+                break
+        data = {"url": url, "checked_at": time.time()}
+        CACHE.put(make_aleph_cache_key(foreign_id), data)
+        return url
+
+
+def get_aleph_url(foreign_id: str) -> str | None:
+    cached, url = get_cached_aleph_url(foreign_id)
+    if cached:
+        return url
+    try:
+        res = httpx.get(ALEPH_URL.format(foreign_id=foreign_id))
+    except httpx.HTTPError as e:
+        log.warning(f"{e.__class__.__name__}: {e}", foreign_id=foreign_id)
+        return
+    return parse_aleph_url(foreign_id, res)
+
+
+async def _prefetch_aleph_urls(foreign_ids: Iterable[str]) -> None:
+    semaphore = asyncio.Semaphore(ALEPH_CONCURRENCY)
+    limits = httpx.Limits(max_connections=ALEPH_CONCURRENCY)
+
+    async def _fetch(client: httpx.AsyncClient, foreign_id: str) -> None:
+        async with semaphore:
+            try:
+                res = await client.get(ALEPH_URL.format(foreign_id=foreign_id))
+            except httpx.HTTPError as e:
+                log.warning(f"{e.__class__.__name__}: {e}", foreign_id=foreign_id)
+                return
+            parse_aleph_url(foreign_id, res)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        await asyncio.gather(*(_fetch(client, f) for f in foreign_ids))
+
+
+def prefetch_aleph_urls(foreign_ids: Iterable[str]) -> None:
+    """Concurrently look up the aleph urls for all uncached datasets"""
+    foreign_ids = {f for f in foreign_ids if not get_cached_aleph_url(f)[0]}
+    if foreign_ids:
+        log.info("Prefetching Aleph collections ...", datasets=len(foreign_ids))
+        asyncio.run(_prefetch_aleph_urls(foreign_ids))
+
+
+def is_remote(uri: str) -> bool:
+    return uri.startswith(("http://", "https://"))
+
+
+def make_uri_key(uri: str) -> str:
+    """Normalize local paths to look up loaded uris"""
+    if is_remote(uri) or uri == "-":
+        return uri
+    return os.path.abspath(uri)
+
+
+def make_catalog_cache_key(uri: str) -> str:
+    parsed = urlparse(uri)
+    return f"{parsed.netloc}/{parsed.path.strip('/')}"
+
+
+def parse_catalog(content: str | bytes) -> dict[str, Any]:
+    try:
+        return json.loads(content)
+    except ValueError:
+        return yaml.safe_load(content)
+
+
+async def fetch_catalog(client: httpx.AsyncClient, uri: str) -> bytes:
+    """
+    Fetch a remote catalog via a local copy, which is only revalidated
+    (conditional GET) after `CATALOG_CACHE_TTL`
+    """
+    key = make_catalog_cache_key(uri)
+    meta_key = f"{key}.meta"
+    meta = {}
+    if CATALOG_CACHE.exists(meta_key) and CATALOG_CACHE.exists(key):
+        meta = json.loads(CATALOG_CACHE.get(meta_key))
+        if time.time() - meta["checked_at"] < CATALOG_CACHE_TTL:
+            return CATALOG_CACHE.get(key)
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        res = await client.get(uri, headers=headers, follow_redirects=True)
+        if res.status_code != 304 or not meta:
+            res.raise_for_status()
+    except httpx.HTTPError as e:
+        if not meta:
+            raise
+        log.warning(f"Using stale catalog: `{e.__class__.__name__}: {e}`", uri=uri)
+        return CATALOG_CACHE.get(key)
+    if res.status_code == 304:
+        content = CATALOG_CACHE.get(key)
+    else:
+        log.info("Downloaded catalog.", uri=uri)
+        content = res.content
+        CATALOG_CACHE.put(key, content)
+        meta = {}
+    meta = {
+        "etag": res.headers.get("etag", meta.get("etag")),
+        "last_modified": res.headers.get("last-modified", meta.get("last_modified")),
+        "checked_at": time.time(),
+    }
+    CATALOG_CACHE.put(meta_key, json.dumps(meta).encode())
+    return content
+
+
+async def load_uri(client: httpx.AsyncClient, uri: str) -> dict[str, Any]:
+    if is_remote(uri):
+        return parse_catalog(await fetch_catalog(client, uri))
+    return parse_catalog(await asyncio.to_thread(smart_read, uri))
+
+
+def iter_uris(data: dict[str, Any]) -> Generator[str, None, None]:
+    for key in ("datasets", "include_catalogs"):
+        for item in ensure_list(data.get(key)):
+            if item.get("from_uri"):
+                yield item["from_uri"]
+            else:
+                yield from iter_uris(item)
+
+
+async def _load_uris(data: dict[str, Any], loaded: dict[str, Any]) -> None:
+    semaphore = asyncio.Semaphore(CATALOG_CONCURRENCY)
+    limits = httpx.Limits(max_connections=CATALOG_CONCURRENCY)
+
+    async def _load(client: httpx.AsyncClient, key: str, uri: str) -> None:
+        async with semaphore:
+            loaded[key] = await load_uri(client, uri)
+
+    def _get_missing(uris: Iterable[str]) -> dict[str, str]:
+        uris = {make_uri_key(uri): uri for uri in uris}
+        return {k: u for k, u in uris.items() if k not in loaded}
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        uris = _get_missing(iter_uris(data))
+        while uris:
+            await asyncio.gather(*(_load(client, k, u) for k, u in uris.items()))
+            # loaded catalogs can reference further catalogs
+            uris = _get_missing(u for k in uris for u in iter_uris(loaded[k]))
+
+
+def resolve(data: dict[str, Any], loaded: dict[str, Any]) -> dict[str, Any]:
+    """Replace `from_uri` references with the loaded data, like `RemoteMixin`"""
+    data = dict(data)
+    from_uri = data.pop("from_uri", None)
+    if from_uri is not None:
+        data = clean_dict({**loaded[make_uri_key(from_uri)], **clean_dict(data)})
+        data["uri"] = data.get("uri") or from_uri
+    for key in ("datasets", "include_catalogs"):
+        if key in data:
+            data[key] = [resolve(item, loaded) for item in ensure_list(data[key])]
+    return data
+
+
+def load_catalog(uri: str, loaded: dict[str, Any] | None = None) -> "MultiCatalog":
+    """
+    Load a catalog and concurrently fetch all the catalogs and datasets it
+    references via `from_uri`. Pass in `loaded` to share already loaded uris
+    across multiple catalogs.
+    """
+    loaded = {} if loaded is None else loaded
+    asyncio.run(_load_uris({"include_catalogs": [{"from_uri": uri}]}, loaded))
+    return MultiCatalog(**resolve(loaded[make_uri_key(uri)], loaded))
 
 
 class Catalog(BaseCatalog):
@@ -31,22 +230,28 @@ class Catalog(BaseCatalog):
     exclude_datasets: list[str] = []
     patch_metadata: dict[str, Any] = {}
 
-    def patch_dataset(self, ds: Dataset) -> Dataset:
+    def get_dataset_name(self, ds: Dataset) -> str:
         prefix = self.patch_metadata.get("dataset_prefix")
         if prefix is not None and ds.name not in self.patch_metadata.get(
             "dataset_prefix_ignore", []
         ):
             if not ds.name.startswith(prefix):
-                ds.name = f"{prefix}_{ds.name}"
-        return Dataset(
-            **{
-                **ds.model_dump(),
-                "aleph_url": get_aleph_url(ds.name),
-                **self.patch_metadata,
-            }
-        )
-
-    def get_datasets(self) -> Generator[Dataset, None, None]:
+                return f"{prefix}_{ds.name}"
+        return ds.name
+
+    def get_patch(self) -> dict[str, Any]:
+        """Validate the `patch_metadata` (once) that applies to dataset fields"""
+        ds = Dataset(**{"name": self.name, **self.patch_metadata})
+        return ds.model_dump(mode="json", include=set(self.patch_metadata))
+
+    def patch_dataset(self, ds: Dataset, patch: dict[str, Any]) -> dict[str, Any]:
+        data = ds.model_dump(mode="json")
+        data["name"] = self.get_dataset_name(ds)
+        data["aleph_url"] = get_aleph_url(data["name"])
+        data.update(patch)
+        return data
+
+    def iterate_datasets(self) -> Generator[Dataset, None, None]:
         for dataset in self.datasets:
             if self.include_datasets and not any(
                 (fnmatch.fnmatch(dataset.name, m) for m in self.include_datasets)
@@ -56,39 +261,77 @@ class Catalog(BaseCatalog):
                 (fnmatch.fnmatch(dataset.name, m) for m in self.exclude_datasets)
             ):
                 continue
-            yield self.patch_dataset(dataset)
+            yield dataset
+
+    def get_dataset_names(self) -> Generator[str, None, None]:
+        for dataset in self.iterate_datasets():
+            yield self.get_dataset_name(dataset)
+
+    def get_datasets(self) -> Generator[dict[str, Any], None, None]:
+        patch = self.get_patch()
+        key = orjson.dumps(self.patch_metadata, option=orjson.OPT_SORT_KEYS)
+        for dataset in self.iterate_datasets():
+            if self.uri is None:
+                yield self.patch_dataset(dataset, patch)
+                continue
+            # the same catalog can be included (with the same patch) by several
+            # outputs of a run
+            cache_key = (make_uri_key(str(self.uri)), key, dataset.name)
+            if cache_key not in PATCHED_DATASETS:
+                PATCHED_DATASETS[cache_key] = self.patch_dataset(dataset, patch)
+            yield PATCHED_DATASETS[cache_key]
 
 
 class MultiCatalog(Catalog):
     include_catalogs: list[Catalog]
 
-    def get_datasets(self) -> Generator[Dataset, None, None]:
+    def get_dataset_names(self) -> Generator[str, None, None]:
+        yield from super().get_dataset_names()
+        for catalog in self.include_catalogs:
+            yield from catalog.get_dataset_names()
+
+    def get_datasets(self) -> Generator[dict[str, Any], None, None]:
         yield from super().get_datasets()
         for catalog in self.include_catalogs:
             yield from catalog.get_datasets()
 
-    def serialize(self) -> str:
-        seen = set()
-        catalog = Catalog(name=self.name)
+    def serialize(self, fh: BinaryIO) -> None:
+        """Write the catalog json incrementally, one dataset at a time"""
+        prefetch_aleph_urls(self.get_dataset_names())
+        catalog = Catalog(name=self.name).model_dump(mode="json")
+        catalog.pop("datasets")
+        fh.write(orjson.dumps(catalog)[:-1] + b',"datasets":[')
+        names = set()
         for dataset in self.get_datasets():
-            if dataset.name not in seen:
-                catalog.datasets.append(dataset)
-                seen.add(dataset.name)
-
-        return catalog.model_dump_json()
+            if dataset["name"] not in names:
+                if names:
+                    fh.write(b",")
+                fh.write(orjson.dumps(dataset))
+                names.add(dataset["name"])
+        fh.write(b"]}")
 
 
 def main(
-    in_uri: Annotated[str, typer.Option("-i")] = "-",
-    out_uri: Annotated[str, typer.Option("-o")] = "-",
+    in_uris: Annotated[list[str], typer.Option("-i")] = ["-"],
+    out_uris: Annotated[list[str], typer.Option("-o")] = ["-"],
 ):
     """
     Build a catalog from datasets metadata and write it to anywhere from stdout
     (default) to any uri `anystore` can handle.
+
+    Multiple catalogs can be built in one run by passing several `-i` / `-o`
+    pairs. Loaded catalogs and patched datasets are shared, and an output can
+    be referenced by the inputs that follow it.
     """
-    catalog = MultiCatalog._from_uri(in_uri)
-    data = catalog.serialize()
-    smart_write(out_uri, data.encode())
+    if len(in_uris) != len(out_uris):
+        raise typer.BadParameter("Pass an output uri (-o) for each input uri (-i)")
+    loaded: dict[str, Any] = {}
+    for in_uri, out_uri in zip(in_uris, out_uris):
+        catalog = load_catalog(in_uri, loaded)
+        with smart_open(out_uri, "wb") as fh:
+            catalog.serialize(fh)
+        # later inputs read the fresh output instead of a previously loaded one
+        loaded.pop(make_uri_key(out_uri), None)
 
 
 if __name__ == "__main__":
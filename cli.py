@@ -23,6 +23,9 @@ def cli_make_catalog(
 @cli.command("push-config")
 def cli_push_config(
     dataset: Annotated[Optional[str], typer.Option("-d", help="Dataset name")] = None,
+    force: Annotated[
+        Optional[bool], typer.Option(help="Upload unchanged configs as well")
+    ] = False,
 ):
-    """Push a dataset config or all configs to the remote storage"""
-    push_dataset_configs(dataset)
+    """Push changed dataset configs (or one) to the remote storage"""
+    push_dataset_configs(dataset, force=force)
@@ -4,7 +4,7 @@ from anystore.decorators import anycache
 from banal import ensure_dict
 from memorious.logic.context import Context
 
-from utils.cache import make_url_cache_key
+from utils.cache import make_url_cache_key, revalidate_urls
 from utils.operations import cached_emit
 
 DEFAULT_URL = "https://fragdenstaat.de/api/v1/document"
@@ -31,19 +31,22 @@ def reduce_publicbody(data: dict[str, Any]) -> dict[str, Any]:
 def seed(context, data):
     url = data.get("url") or context.get("url", DEFAULT_URL)
     res = context.http.get(url)
-
-    for document in res.json["objects"]:
-        if document.get("foirequest") is not None:
-            publicbody = get_publicbody(context, document["publicbody"])
-            data = {
-                **document,
-                "url": document["file_url"],
-                "source_url": document["site_url"],
-                "publicbody": reduce_publicbody(publicbody),
-            }
-
-            if data["url"]:
-                cached_emit(context, data)
+    documents = [d for d in res.json["objects"] if d.get("foirequest") is not None]
+
+    # update the url status index for the publicbody cache keys in one batch
+    revalidate_urls(d["publicbody"] for d in documents)
+
+    for document in documents:
+        publicbody = get_publicbody(context, document["publicbody"])
+        data = {
+            **document,
+            "url": document["file_url"],
+            "source_url": document["site_url"],
+            "publicbody": reduce_publicbody(publicbody),
+        }
+
+        if data["url"]:
+            cached_emit(context, data)
 
     if res.json["meta"]["next"] is not None:
         context.recurse(data={"url": res.json["meta"]["next"]})
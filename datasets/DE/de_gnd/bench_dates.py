@@ -0,0 +1,121 @@
+"""
+Compare `transform.convert_to_iso_date` against the previous `strptime` based
+implementation on a sample of GND date values:
+
+    python bench_dates.py
+"""
+
+import os
+import random
+import timeit
+from datetime import datetime
+
+import typer
+from investigraph.util import get_func
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+convert_to_iso_date = get_func("./transform.py:convert_to_iso_date", BASE_PATH)
+
+# value shapes as they occur in dateOfBirth, dateOfDeath and dateOfEstablishment
+SAMPLE = [
+    "1950",
+    "1871",
+    "2001",
+    "1950-05-12",
+    "1950-05",
+    "12.05.1950",
+    "1.5.1950",
+    "XX.05.1950",
+    "XX.XX.1950",
+    "12.05.50",
+    "05.1950",
+    "1950, 12.05.",
+    "1950,12.05.",
+    "1950,05,12",
+    "1950,Mai.",
+    "1950,Mar.",
+    "1950,Mar",
+    "1950,March",
+    "1950,12.March",
+    "1950/05",
+    "1950,12.Mar.",
+    "31.02.1950",
+    "1950-1955",
+    "ca. 1950",
+    "19XX",
+    "v1950",
+    "",
+]
+
+
+def convert_to_iso_date_strptime(date_str: str) -> str:
+    date_str = date_str.replace("XX.", "")
+    formats = [
+        "%Y-%m-%d",
+        "%Y-%m",
+        "%Y",
+        "%d.%m.%Y",
+        "%d.%m.%y",
+        "%m.%Y",
+        "%Y, %d.%m.",
+        "%Y,%d.%m.",
+        "%Y,%m,%d",
+        "%Y,%b.",
+        "%Y,%b",
+        "%Y,%B",
+        "%Y,%d.%B",
+        "%Y/%m",
+        "%Y,%d.%b.",
+        "%Y,%d.%B",
+    ]
+    for format_str in formats:
+        try:
+            date_obj = datetime.strptime(date_str, format_str)
+            if format_str == "%Y":
+                return date_obj.strftime("%Y")
+            elif "%d" not in format_str:
+                return date_obj.strftime("%Y-%m")
+            else:
+                return date_obj.strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return date_str
+
+
+def make_values(size: int) -> list[str]:
+    """Random values with a realistic share of repetitions"""
+    values = random.choices(SAMPLE, k=size // 2)
+    for _ in range(size - len(values)):
+        day, month = random.randint(1, 31), random.randint(1, 12)
+        year = random.randint(1000, 2024)
+        value = random.choice(SAMPLE) or "1950"
+        values.append(
+            value.replace("1950", str(year))
+            .replace("12", f"{day:02d}")
+            .replace("05", f"{month:02d}")
+        )
+    return values
+
+
+def main(size: int = 100_000, number: int = 5):
+    values = make_values(size)
+    for value in set(values):
+        expected = convert_to_iso_date_strptime(value)
+        assert convert_to_iso_date(value) == expected, (value, expected)
+
+    def _run(func):
+        for value in values:
+            func(value)
+
+    for name, func in (
+        ("strptime", convert_to_iso_date_strptime),
+        ("regex", convert_to_iso_date.__wrapped__),
+        ("regex + lru_cache", convert_to_iso_date),
+    ):
+        seconds = min(timeit.repeat(lambda: _run(func), number=1, repeat=number))
+        print(f"{name:20} {size / seconds:12,.0f} values/s")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -1,8 +1,29 @@
+import gc
 import gzip
+import os
+import time
+from itertools import islice
+from typing import IO
 
 import ijson
 from investigraph.model import SourceContext
 from investigraph.types import Record, RecordGenerator
+from investigraph.util import get_func
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+# resolve the vocab titles referenced by this many records at once
+CHUNK_SIZE = 10_000
+LOG_INTERVAL = 100_000
+# the parsed records are all containers, with the default threshold the cyclic
+# garbage collector runs over and over while a chunk is held in memory
+GC_THRESHOLD = 100_000
+
+try:
+    items = ijson.get_backend("yajl2_c").items
+except ImportError:  # pure python fallback, much slower
+    items = ijson.items
+
+resolve_records = get_func("./sru.py:resolve_records", BASE_PATH)
 
 
 def get_type(record: Record) -> str | None:
@@ -23,9 +44,38 @@ def should_transform(ctx: SourceContext, record: Record) -> bool:
     return False
 
 
+def iter_records(ctx: SourceContext, fh: IO[bytes]) -> RecordGenerator:
+    start = time.time()
+    ix = skipped = 0
+    for ix, record in enumerate(items(fh, "item.item"), 1):
+        if should_transform(ctx, record):
+            yield record
+        else:
+            skipped += 1
+        if ix % LOG_INTERVAL == 0:
+            ctx.log.info(
+                f"Parsed {ix} records ...",
+                skipped=skipped,
+                records_per_second=round(ix / (time.time() - start)),
+                source=ctx.source.name,
+            )
+    ctx.log.info(
+        f"Parsed {ix} records.",
+        skipped=skipped,
+        records_per_second=round(ix / max(time.time() - start, 0.001)),
+        source=ctx.source.name,
+    )
+
+
 def handle(ctx: SourceContext, *args, **kwargs) -> RecordGenerator:
-    with ctx.open() as gzfh:
-        with gzip.open(gzfh) as fh:
-            for record in ijson.items(fh, "item.item"):
-                if should_transform(ctx, record):
-                    yield record
+    threshold = gc.get_threshold()
+    gc.set_threshold(GC_THRESHOLD, *threshold[1:])
+    try:
+        with ctx.open() as gzfh:
+            with gzip.open(gzfh) as fh:
+                records = iter_records(ctx, fh)
+                while chunk := list(islice(records, CHUNK_SIZE)):
+                    resolve_records(chunk)
+                    yield from chunk
+    finally:
+        gc.set_threshold(*threshold)
@@ -0,0 +1,79 @@
+"""
+Run the de_gnd pipeline with the transform stage in a pool of worker
+processes, each writing its entity fragments in bulk to the statement store:
+
+    python parallel.py -j 8
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Annotated
+
+import typer
+from anystore.logging import get_logger
+from investigraph.logic.transform import transform_record
+from investigraph.model.context import get_dataset_context
+from investigraph.types import Record
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+CONFIG_URI = os.path.join(BASE_PATH, "config.yml")
+
+log = get_logger(f"investigraph.datasets.de_gnd.{__name__}")
+
+
+def transform_batch(config_uri: str, records: list[Record], offset: int) -> int:
+    """Transform a batch of records and write the entities to the store"""
+    ctx = get_dataset_context(config_uri)
+    ix = 0
+    with ctx.store.writer() as bulk:
+        for index, record in enumerate(records, offset):
+            for proxy in transform_record(config_uri, record, index):
+                bulk.add_entity(proxy)
+                ix += 1
+    return ix
+
+
+def run(
+    config_uri: Annotated[str, typer.Argument()] = CONFIG_URI,
+    workers: Annotated[int, typer.Option("-j")] = os.cpu_count() or 1,
+    batch_size: Annotated[int, typer.Option("-b")] = 10_000,
+    source: Annotated[str | None, typer.Option("-s")] = None,
+):
+    """
+    Extract the records (optionally only for the given source) and transform
+    them in batches within a process pool.
+    """
+    ctx = get_dataset_context(config_uri)
+    records = (
+        record
+        for sctx in ctx.get_sources()
+        if source is None or sctx.source.name == source
+        for record in sctx.extract()
+    )
+    # don't inherit open handles (e.g. the vocab table) of the extract stage
+    mp_context = multiprocessing.get_context("spawn")
+    fragments = 0
+    offset = 1
+    with ProcessPoolExecutor(workers, mp_context=mp_context) as pool:
+        pending = set()
+        while batch := list(islice(records, batch_size)):
+            # keep memory bounded if extraction is faster than transform
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                fragments += sum(future.result() for future in done)
+            pending.add(pool.submit(transform_batch, config_uri, batch, offset))
+            offset += len(batch)
+        fragments += sum(future.result() for future in wait(pending).done)
+    log.info(
+        "Transform complete.",
+        dataset=ctx.dataset,
+        records=offset - 1,
+        fragments=fragments,
+        store=ctx.config.load.uri,
+    )
+
+
+if __name__ == "__main__":
+    typer.run(run)
@@ -1,15 +1,32 @@
 import httpx
-from typing import Any
+import os
+from itertools import islice
+from typing import Any, Iterable
 
-from anystore.decorators import anycache, error_handler
+from anystore.decorators import error_handler
 from bs4 import BeautifulSoup
 from anystore.logging import get_logger
 from investigraph.settings import Settings
+from investigraph.types import Record
+from investigraph.util import get_func
 
 
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+get_title_from_vocab = get_func("./vocab.py:get_title", BASE_PATH)
+
 settings = Settings()
 CACHE = settings.cache.to_store()
+SRU_URL = "https://services.dnb.de/sru/authorities"
+# max records per request the dnb sru api allows
+SRU_BATCH_SIZE = 100
 VOCAB_CONFIG = {"place": "Tg", "profession": "Ts"}
+BASE = "https://d-nb.info/standards/elementset/gnd#"
+VOCAB_FIELDS = {
+    BASE + "placeOfBirth": "place",
+    BASE + "placeOfBusiness": "place",
+    BASE + "professionOrOccupation": "profession",
+}
 
 log = get_logger(f"investigraph.datasets.de_gnd.{__name__}")
 
@@ -23,34 +40,96 @@ def get_value(record, datafield: str) -> str:
         return ""
 
 
-def get_params(gndId: str, vocab_type: str) -> dict[str, Any]:
-    query = f"WOE={gndId} and BBG={vocab_type}*"
+def get_params(gndIds: Iterable[str], vocab_type: str) -> dict[str, Any]:
+    woe = " or ".join(f"WOE={gndId}" for gndId in gndIds)
+    query = f"({woe}) and BBG={VOCAB_CONFIG[vocab_type]}*"
     params = {
         "version": "1.1",
         "operation": "searchRetrieve",
         "query": query,
-        "maximumRecords": 10,
+        "maximumRecords": SRU_BATCH_SIZE,
         "recordSchema": "MARC21-xml",
     }
     return params
 
 
-@anycache(store=CACHE)
+def make_cache_key(gndId: str, vocab_type: str) -> str:
+    return f"de_gnd/sru/{vocab_type}/{gndId}"
+
+
 @error_handler(max_retries=10)
-def get_title_from_sru_request(gndId: str, vocab_type: str) -> str:
-    value = ""
-    sru_url = "https://services.dnb.de/sru/authorities"
-    response = httpx.get(sru_url, params=get_params(gndId, vocab_type))
-    if response is not None:
+def get_titles_from_sru_request(gndIds: list[str], vocab_type: str) -> dict[str, str]:
+    """Query the titles for multiple ids at once, following result pages"""
+    titles = {}
+    params = get_params(gndIds, vocab_type)
+    while True:
+        response = httpx.get(SRU_URL, params=params)
+        response.raise_for_status()
         soup = BeautifulSoup(response.text, "xml")
-        records = soup.find_all("record")
-        for record in records:
+        for record in soup.find_all("record"):
             recordId = get_value(record, "024")
-            if gndId == recordId:
-                if vocab_type == "place":
-                    value = get_value(record, "151")
-                else:
-                    value = get_value(record, "150")
+            if vocab_type == "place":
+                titles[recordId] = get_value(record, "151")
+            else:
+                titles[recordId] = get_value(record, "150")
+        next_position = soup.find("nextRecordPosition")
+        if next_position is None:
+            return titles
+        params["startRecord"] = next_position.get_text()
+
+
+def get_title_from_sru_request(gndId: str, vocab_type: str) -> str:
+    """
+    Get the title from the cache or query it. Titles of failed requests are
+    not cached, so that they are queried again next time.
+    """
+    key = make_cache_key(gndId, vocab_type)
+    value = CACHE.get(key, raise_on_nonexist=False, serialization_mode="json")
+    if value is not None:
+        return value
+    titles = get_titles_from_sru_request([gndId], vocab_type)
+    if titles is None:
+        log.error(f"GND Id: {gndId} request failed")
+        return ""
+    value = titles.get(gndId, "")
     if not value:
         log.warning(f"GND Id: {gndId} not found")
+    CACHE.put(key, value, serialization_mode="json")
     return value
+
+
+def resolve_titles(gndIds: Iterable[str], vocab_type: str) -> None:
+    """
+    Fetch the titles of all ids that are neither in the local vocab table nor
+    cached in batched (OR-combined) queries and store them in the cache used by
+    `get_title_from_sru_request`
+    """
+    gndIds = {
+        i
+        for i in gndIds
+        if get_title_from_vocab(i, vocab_type) is None
+        and not CACHE.exists(make_cache_key(i, vocab_type))
+    }
+    gndIds = iter(sorted(gndIds))
+    while batch := list(islice(gndIds, SRU_BATCH_SIZE)):
+        titles = get_titles_from_sru_request(batch, vocab_type)
+        if titles is None:  # request failed, don't cache the ids as not found
+            continue
+        for gndId in batch:
+            value = titles.get(gndId, "")
+            if not value:
+                log.warning(f"GND Id: {gndId} not found")
+            key = make_cache_key(gndId, vocab_type)
+            CACHE.put(key, value, serialization_mode="json")
+
+
+def resolve_records(records: Iterable[Record]) -> None:
+    """Resolve the place and profession titles referenced by the given records"""
+    gndIds = {vocab_type: set() for vocab_type in VOCAB_CONFIG}
+    for record in records:
+        for key, vocab_type in VOCAB_FIELDS.items():
+            for value in record.get(key, []):
+                if "@id" in value:
+                    gndIds[vocab_type].add(value["@id"].split("/")[-1])
+    for vocab_type, ids in gndIds.items():
+        resolve_titles(ids, vocab_type)
@@ -1,19 +1,36 @@
+"""
+GND subject categories (gnd-sc), bundled as `standard_vocab.json` next to this
+file. Update it explicitly:
+
+    python standard_vocab.py refresh-vocab
+
+The transform fails without the bundled file.
+"""
+
+import json
+import os
+from datetime import date
+from functools import cache
+from types import MappingProxyType
+from typing import Mapping
+
 import httpx
-from anystore import anycache
+import typer
 from bs4 import BeautifulSoup
 from anystore.logging import get_logger
-from investigraph.settings import Settings
 
-settings = Settings()
-CACHE = settings.cache.to_store()
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+VOCAB_URL = "https://d-nb.info/standards/vocab/gnd/gnd-sc.html"
+VOCAB_PATH = os.path.join(BASE_PATH, "standard_vocab.json")
 
 log = get_logger(f"investigraph.datasets.de_gnd.{__name__}")
 
+cli = typer.Typer()
 
-@anycache(store=CACHE, serialization_mode="json")
-def get_standard_vocab() -> dict[str, str]:
-    url = "https://d-nb.info/standards/vocab/gnd/gnd-sc.html"
-    res = httpx.get(url)
+
+def fetch_standard_vocab() -> dict[str, str]:
+    res = httpx.get(VOCAB_URL)
+    res.raise_for_status()
     soup = BeautifulSoup(res.text, "html")
     records = soup.find_all("div", class_="card-header")
     vocab = {}
@@ -24,7 +41,19 @@ def get_standard_vocab() -> dict[str, str]:
     return vocab
 
 
-# @anycache(store=CACHE)
+@cache
+def get_standard_vocab() -> Mapping[str, str]:
+    """Load the bundled vocab once per process"""
+    if not os.path.exists(VOCAB_PATH):
+        raise FileNotFoundError(
+            f"No bundled vocab at `{VOCAB_PATH}`, "
+            "run `python standard_vocab.py refresh-vocab`"
+        )
+    with open(VOCAB_PATH) as fh:
+        data = json.load(fh)
+    return MappingProxyType(data["vocab"])
+
+
 def get_title_from_standard_vocab(gnd_id: str) -> str:
     vocab = get_standard_vocab()
     try:
@@ -32,3 +61,22 @@ def get_title_from_standard_vocab(gnd_id: str) -> str:
     except KeyError:
         log.warning(f"{gnd_id} not in GND standard vocab.")
         return gnd_id
+
+
+@cli.callback()
+def main():
+    """GND standard vocab"""
+
+
+@cli.command("refresh-vocab")
+def refresh_vocab():
+    """Download the current GND subject categories into the bundled vocab"""
+    vocab = fetch_standard_vocab()
+    data = {"version": date.today().isoformat(), "url": VOCAB_URL, "vocab": vocab}
+    with open(VOCAB_PATH, "w") as fh:
+        json.dump(data, fh, indent=2, ensure_ascii=False, sort_keys=True)
+    log.info("Updated GND standard vocab.", path=VOCAB_PATH, terms=len(vocab))
+
+
+if __name__ == "__main__":
+    cli()
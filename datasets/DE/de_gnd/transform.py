@@ -1,5 +1,9 @@
+import calendar
 import os
-from datetime import datetime
+import re
+from datetime import date
+from functools import lru_cache, partial
+from typing import Callable, TypeAlias
 
 from investigraph.model import SourceContext, TaskContext
 from investigraph.types import CE, CEGenerator, Record
@@ -7,13 +11,18 @@ from investigraph.util import get_func
 
 BASE_PATH = os.path.dirname(os.path.realpath(__file__))
 
+Plan: TypeAlias = list[tuple[str, str, list[Callable[[str], str]]]]
+
 get_title_from_sru_request = get_func("./sru.py:get_title_from_sru_request", BASE_PATH)
+get_title_from_vocab = get_func("./vocab.py:get_title", BASE_PATH)
 get_title_from_standard_vocab = get_func(
     "./standard_vocab.py:get_title_from_standard_vocab", BASE_PATH
 )
 
 
 BASE = "https://d-nb.info/standards/elementset/gnd#"
+SAME_AS = "http://www.w3.org/2002/07/owl#sameAs"
+REFERENCE_DOMAINS = {"wikidata": "wikidataId", "viaf": "viafId", "isni": "isni"}
 
 PERSON_MAPPING = {
     "preferredNameForThePerson": "name",
@@ -60,20 +69,23 @@ def get_country_code(country_uri: str) -> str:
             return country_uri
 
 
-def process(key: str, values: list[str]) -> list[str]:
-    if "date" in key.lower():
-        values = [convert_to_iso_date(elem) for elem in values]
-    if "country" in key.lower():
-        values = [get_country_code(elem) for elem in values]
-    if "gender" in key.lower():
-        values = [extract_gender(elem) for elem in values]
-    if "position" in key.lower():
-        values = [get_title_from_vocab_url(elem, "profession") for elem in values]
-    if "place" in key.lower() or "address" in key.lower():
-        values = [get_title_from_vocab_url(elem, "place") for elem in values]
-    if "classification" in key.lower():
-        values = [get_title_from_standard_vocab(elem) for elem in values]
-    return values
+def get_converters(key: str) -> list[Callable[[str], str]]:
+    """The value converters to apply (in order) for a FtM property"""
+    key = key.lower()
+    converters = []
+    if "date" in key:
+        converters.append(convert_to_iso_date)
+    if "country" in key:
+        converters.append(get_country_code)
+    if "gender" in key:
+        converters.append(extract_gender)
+    if "position" in key:
+        converters.append(partial(get_title_from_vocab_url, category_type="profession"))
+    if "place" in key or "address" in key:
+        converters.append(partial(get_title_from_vocab_url, category_type="place"))
+    if "classification" in key:
+        converters.append(get_title_from_standard_vocab)
+    return converters
 
 
 def get_values(record: Record, key: str) -> list[str]:
@@ -85,41 +97,104 @@ def get_values(record: Record, key: str) -> list[str]:
 
 def get_title_from_vocab_url(url: str, category_type: str) -> str:
     gndId = extract_id(url)
-    return get_title_from_sru_request(gndId, category_type)
+    title = get_title_from_vocab(gndId, category_type)
+    if title is None:
+        return get_title_from_sru_request(gndId, category_type)
+    return title
+
+
+MONTHS = {
+    name.lower(): ix
+    for names in (calendar.month_abbr, calendar.month_name)
+    for ix, name in enumerate(names)
+    if ix
+}
+# mimic the `datetime.strptime` directives
+DATE_FIELDS = {
+    "Y": r"\d\d\d\d",
+    "y": r"\d\d",
+    "m": r"1[0-2]|0[1-9]|[1-9]",
+    "d": r"3[01]|[12]\d|0[1-9]|[1-9]| [1-9]",
+    "b": "|".join(sorted(map(str.lower, calendar.month_abbr[1:]), key=len)[::-1]),
+    "B": "|".join(sorted(map(str.lower, calendar.month_name[1:]), key=len)[::-1]),
+}
+# date shapes in order of precedence and their iso precision
+DATE_FORMATS = [
+    (r"{Y}-{m}-{d}", "day"),
+    (r"{Y}-{m}", "month"),
+    (r"{Y}", "year"),
+    (r"{d}\.{m}\.{Y}", "day"),
+    (r"{d}\.{m}\.{y}", "day"),
+    (r"{m}\.{Y}", "month"),
+    (r"{Y},\s+{d}\.{m}\.", "day"),
+    (r"{Y},{d}\.{m}\.", "day"),
+    (r"{Y},{m},{d}", "day"),
+    (r"{Y},{b}\.", "month"),
+    (r"{Y},{b}", "month"),
+    (r"{Y},{B}", "month"),
+    (r"{Y},{d}\.{B}", "day"),
+    (r"{Y}/{m}", "month"),
+    (r"{Y},{d}\.{b}\.", "day"),
+]
+
+
+def compile_date_format(fmt: str, capture: bool = True) -> str:
+    if capture:
+        fields = {k: f"(?P<{k}>{v})" for k, v in DATE_FIELDS.items()}
+    else:
+        fields = {k: f"(?:{v})" for k, v in DATE_FIELDS.items()}
+    return fmt.format(**fields)
+
+
+DATE_PATTERNS = [
+    (re.compile(compile_date_format(fmt), re.I), precision)
+    for fmt, precision in DATE_FORMATS
+]
+# one pass to find the first matching shape (the outer group name is its index)
+DATE_RE = re.compile(
+    "|".join(
+        f"(?P<f{ix}>{compile_date_format(fmt, capture=False)})"
+        for ix, (fmt, _) in enumerate(DATE_FORMATS)
+    ),
+    re.I,
+)
+
+
+def make_iso_date(match: re.Match, precision: str) -> str:
+    data = match.groupdict()
+    if data.get("y") is not None:
+        year = int(data["y"])
+        year += 2000 if year < 69 else 1900
+    else:
+        year = int(data["Y"])
+    if data.get("m") is not None:
+        month = int(data["m"])
+    else:
+        month = MONTHS.get((data.get("b") or data.get("B") or "jan").lower())
+    day = int(data.get("d") or 1)
+    date(year, month, day)  # validate
+    if precision == "year":
+        return str(year)
+    if precision == "month":
+        return f"{year}-{month:02d}"
+    return f"{year}-{month:02d}-{day:02d}"
 
 
 # TODO: Move into general utils function and convert
+@lru_cache(100_000)
 def convert_to_iso_date(date_str: str) -> str:
     date_str = date_str.replace("XX.", "")
-    formats = [
-        "%Y-%m-%d",
-        "%Y-%m",
-        "%Y",
-        "%d.%m.%Y",
-        "%d.%m.%y",
-        "%m.%Y",
-        "%Y, %d.%m.",
-        "%Y,%d.%m.",
-        "%Y,%m,%d",
-        "%Y,%b.",
-        "%Y,%b",
-        "%Y,%B",
-        "%Y,%d.%B",
-        "%Y/%m",
-        "%Y,%d.%b.",
-        "%Y,%d.%B",
-    ]
-    for format_str in formats:
-        try:
-            date_obj = datetime.strptime(date_str, format_str)
-            if format_str == "%Y":
-                return date_obj.strftime("%Y")
-            elif "%d" not in format_str:
-                return date_obj.strftime("%Y-%m")
-            else:
-                return date_obj.strftime("%Y-%m-%d")
-        except ValueError:
-            continue
+    match = DATE_RE.fullmatch(date_str)
+    if match is None:
+        return date_str
+    # an invalid date (e.g. 31.02.) falls through to the next matching shape
+    for pattern, precision in DATE_PATTERNS[int(match.lastgroup[1:]) :]:
+        match = pattern.fullmatch(date_str)
+        if match is not None:
+            try:
+                return make_iso_date(match, precision)
+            except ValueError:
+                continue
     return date_str
 
 
@@ -134,21 +209,12 @@ def extract_gender(gender_str: str) -> str:
     return ""
 
 
-def get_reference_id(record: Record, domain: str) -> list[str]:
-    key = "http://www.w3.org/2002/07/owl#sameAs"
-    if key in record.keys():
-        return [
-            item.get("@id", "").split("/")[-1]
-            for item in record[key]
-            if domain in item.get("@id")
-        ]
-    return []
-
-
 def add_reference_urls(proxy, record: Record) -> CE:
-    reference_domains = {"wikidata": "wikidataId", "viaf": "viafId", "isni": "isni"}
-    for reference_domain, ftm_key in reference_domains.items():
-        proxy.add(ftm_key, get_reference_id(record, reference_domain))
+    for item in record.get(SAME_AS, []):
+        url = item.get("@id", "")
+        for reference_domain, ftm_key in REFERENCE_DOMAINS.items():
+            if reference_domain in url:
+                proxy.add(ftm_key, url.split("/")[-1])
     return proxy
 
 
@@ -164,11 +230,25 @@ def create_relationships(ctx: TaskContext, person_id: str, record: Record) -> No
                 ctx.emit(make_family(ctx, person_id, relative_id, relation))
 
 
-def add_properties(proxy, record: Record, mapping: dict[str, str]) -> CE:
-    for gnd_key, ftm_key in mapping.items():
-        values = get_values(record, gnd_key)
-        proc_values = process(ftm_key, values)
-        proxy.add(ftm_key, proc_values)
+def compile_mapping(mapping: dict[str, str]) -> Plan:
+    """Compile a mapping into (GND predicate, FtM property, value converters)"""
+    return [
+        (BASE + gnd_key, ftm_key, get_converters(ftm_key))
+        for gnd_key, ftm_key in mapping.items()
+    ]
+
+
+PERSON_PLAN = compile_mapping(PERSON_MAPPING)
+CORPORATE_PLAN = compile_mapping(CORPORATE_MAPPING)
+
+
+def add_properties(proxy, record: Record, plan: Plan) -> CE:
+    for predicate, ftm_key, converters in plan:
+        if predicate in record:
+            values = [v.get("@value", v.get("@id")) for v in record[predicate]]
+            for convert in converters:
+                values = [convert(value) for value in values]
+            proxy.add(ftm_key, values)
     proxy = add_reference_urls(proxy, record)
     return proxy
 
@@ -203,7 +283,7 @@ def make_person(ctx: TaskContext, record: Record) -> CE | None:
     proxy = ctx.make_proxy("Person")
     proxy.id = ctx.make_slug(extract_id(record["@id"]))
     proxy.add("sourceUrl", record["@id"])
-    proxy = add_properties(proxy, record, PERSON_MAPPING)
+    proxy = add_properties(proxy, record, PERSON_PLAN)
     create_relationships(ctx, proxy.id, record)
     for pos in proxy.get("position"):
         if "politiker" in pos.lower():
@@ -220,7 +300,7 @@ def make_legalentity(ctx: TaskContext, record: Record) -> CE:
     proxy.add(
         "legalForm", [legal_form.split("#")[-1] for legal_form in record["@type"]]
     )
-    proxy = add_properties(proxy, record, CORPORATE_MAPPING)
+    proxy = add_properties(proxy, record, CORPORATE_PLAN)
     if BASE + "corporateBodyIsMember" in record.keys():
         for membership in get_values(record, "corporateBodyIsMember"):
             ctx.emit(make_membership(ctx, proxy, membership))
@@ -231,7 +311,7 @@ def make_company(ctx: TaskContext, record: Record) -> CE:
     proxy = ctx.make_proxy("Company")
     proxy.id = ctx.make_slug(extract_id(record["@id"]))
     proxy.add("sourceUrl", record["@id"])
-    proxy = add_properties(proxy, record, CORPORATE_MAPPING)
+    proxy = add_properties(proxy, record, CORPORATE_PLAN)
     return proxy
 
 
@@ -0,0 +1,91 @@
+"""
+Local lookup table (gnd id -> preferred name) for the place (Tg) and subject
+(Ts) vocabularies, built once from the GND authority dumps:
+
+    python vocab.py
+"""
+
+import gzip
+import os
+import sqlite3
+from functools import cache
+from typing import Generator
+
+import ijson
+import typer
+from anystore.logging import get_logger
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+BASE = "https://d-nb.info/standards/elementset/gnd#"
+VOCAB_DB = os.environ.get("GND_VOCAB_DB", os.path.join(BASE_PATH, "src", "vocab.db"))
+VOCAB_SOURCES = {
+    "place": (
+        "./src/authorities-gnd-geografikum_lds.jsonld.gz",
+        "preferredNameForThePlaceOrGeographicName",
+    ),
+    "profession": (
+        "./src/authorities-gnd-sachbegriff_lds.jsonld.gz",
+        "preferredNameForTheSubjectHeading",
+    ),
+}
+
+log = get_logger(f"investigraph.datasets.de_gnd.{__name__}")
+
+
+def make_key(gndId: str, vocab_type: str) -> str:
+    return f"{vocab_type}:{gndId}"
+
+
+def iter_labels(uri: str, name_key: str) -> Generator[tuple[str, str], None, None]:
+    with gzip.open(os.path.join(BASE_PATH, uri)) as fh:
+        for record in ijson.items(fh, "item.item"):
+            if "about" in record["@id"]:
+                continue
+            for value in record.get(BASE + name_key, []):
+                yield record["@id"].split("/")[-1], value["@value"]
+                break
+
+
+def build(uri: str = VOCAB_DB) -> None:
+    """Build the vocab table from the place and subject authority dumps"""
+    tmp_uri = f"{uri}.tmp"
+    if os.path.exists(tmp_uri):
+        os.remove(tmp_uri)
+    con = sqlite3.connect(tmp_uri)
+    con.execute("CREATE TABLE vocab (key TEXT PRIMARY KEY, label TEXT) WITHOUT ROWID")
+    for vocab_type, (source, name_key) in VOCAB_SOURCES.items():
+        con.executemany(
+            "INSERT OR REPLACE INTO vocab VALUES (?, ?)",
+            (
+                (make_key(gndId, vocab_type), label)
+                for gndId, label in iter_labels(source, name_key)
+            ),
+        )
+        con.commit()
+        log.info(f"Loaded `{vocab_type}` vocab.", source=source)
+    con.close()
+    os.replace(tmp_uri, uri)
+
+
+@cache
+def get_db() -> sqlite3.Connection | None:
+    if not os.path.exists(VOCAB_DB):
+        log.warning(f"No vocab table at `{VOCAB_DB}`, using SRU requests.")
+        return
+    return sqlite3.connect(
+        f"file:{VOCAB_DB}?mode=ro&immutable=1", uri=True, check_same_thread=False
+    )
+
+
+def get_title(gndId: str, vocab_type: str) -> str | None:
+    db = get_db()
+    if db is not None:
+        res = db.execute(
+            "SELECT label FROM vocab WHERE key = ?", (make_key(gndId, vocab_type),)
+        ).fetchone()
+        if res is not None:
+            return res[0]
+
+
+if __name__ == "__main__":
+    typer.run(build)
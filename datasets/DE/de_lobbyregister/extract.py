@@ -0,0 +1,131 @@
+"""
+Stream the register entries. With `LOBBYREGISTER_INCREMENTAL=1` only new
+registrations and new versions of already processed registrations are passed
+on to the transform stage, so that the resulting fragments can be merged into
+an existing persistent statement store (`load.uri`), which is required for
+this mode.
+
+The state of a run is the version and the entity ids of each registration.
+Before a new version of a registration is passed on, the entities of its
+former version are retracted from the store (the ones no other registration
+of the state refers to and that weren't loaded by this run yet), so that
+values the new version dropped don't remain. Registrations that are no longer
+in the register are retracted the same way after the extraction.
+
+The state of a complete extraction is stored as pending in the (persistent)
+archive cache, and only becomes the state for the next run once the load
+stage has finished (see `./load.py`).
+"""
+
+import os
+from collections import Counter
+from typing import Iterable, TypedDict
+
+import ijson
+from anystore.exceptions import DoesNotExist
+from investigraph.cache import get_archive_cache
+from investigraph.model import SourceContext
+from investigraph.types import Record, RecordGenerator
+
+INCREMENTAL = os.environ.get("LOBBYREGISTER_INCREMENTAL", "").lower() in (
+    "1",
+    "true",
+)
+
+
+class Registration(TypedDict):
+    version: str
+    ids: list[str]
+
+
+def make_state_key(ctx: SourceContext, pending: bool | None = False) -> str:
+    key = f"{ctx.dataset}/incremental/{ctx.source.name}"
+    if pending:
+        return f"{key}.pending.json"
+    return f"{key}.json"
+
+
+def make_ids_key(ctx: SourceContext, register_number: str) -> str:
+    """Runtime cache key for the entity ids the transform built for an entry"""
+    return f"{ctx.dataset}/ids/{register_number}"
+
+
+def make_version(record: Record) -> str:
+    details = record.get("registerEntryDetails") or {}
+    return f"{details.get('version')}:{details.get('validFromDate')}"
+
+
+def get_state(ctx: SourceContext) -> dict[str, Registration]:
+    """Registration number -> version and entity ids of the last complete run"""
+    try:
+        return get_archive_cache().get(make_state_key(ctx), serialization_mode="json")
+    except DoesNotExist:
+        return {}
+
+
+def retract(ctx: SourceContext, ids: Iterable[str]) -> int:
+    """Remove the statements of the given entities from the statement store"""
+    retracted = 0
+    with ctx.store.writer() as writer:
+        for entity_id in ids:
+            if writer.pop(entity_id):
+                retracted += 1
+    return retracted
+
+
+def handle(ctx: SourceContext, *args, **kwargs) -> RecordGenerator:
+    """Stream the register entries from the `results` array of the response"""
+    if INCREMENTAL and ctx.config.load.uri.startswith("memory"):
+        raise ValueError(
+            "Incremental mode requires a persistent statement store (`load.uri`)"
+        )
+    state = get_state(ctx) if INCREMENTAL else {}
+    # entity id -> number of registrations of the state referring to it
+    refs = Counter(i for registration in state.values() for i in registration["ids"])
+    # entity ids transformed by this run
+    loaded: set[str] = set()
+
+    def get_owned(registration: Registration) -> list[str]:
+        return [i for i in registration["ids"] if refs[i] == 1 and i not in loaded]
+
+    registrations: dict[str, Registration] = {}
+    retracted = 0
+    newest = None
+    with ctx.open() as fh:
+        for record in ijson.items(fh, "results.item", use_float=True):
+            register_number = record.get("registerNumber")
+            version = make_version(record)
+            newest = newest or register_number
+            former = state.get(register_number)
+            # the source is sorted by registration date, so updated versions of
+            # older registrations can occur anywhere in the stream: keep reading
+            # but don't transform what was already processed
+            if former is not None and former["version"] == version:
+                registrations[register_number] = former
+                continue
+            if former is not None:
+                retracted += retract(ctx, get_owned(former))
+            yield record
+            ids = ctx.cache.pop(
+                make_ids_key(ctx, register_number), serialization_mode="json"
+            )
+            loaded.update(ids)
+            registrations[register_number] = {"version": version, "ids": ids}
+
+    # withdrawn registrations
+    withdrawn = state.keys() - registrations.keys()
+    for register_number in withdrawn:
+        retracted += retract(ctx, get_owned(state[register_number]))
+
+    get_archive_cache().put(
+        make_state_key(ctx, pending=True), registrations, serialization_mode="json"
+    )
+    ctx.log.info(
+        "Extracted register state.",
+        incremental=INCREMENTAL,
+        entries=len(registrations),
+        changed=sum(state.get(k) != v for k, v in registrations.items()),
+        withdrawn=len(withdrawn),
+        retracted=retracted,
+        newest=newest,
+    )
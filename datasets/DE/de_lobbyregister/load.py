@@ -0,0 +1,31 @@
+"""
+Write the proxies to the statement store with the default handler, and only
+afterwards promote the register state of the extraction (see `./extract.py`),
+so that a failed transform or load is repeated by the next incremental run.
+"""
+
+import os
+from typing import Iterable
+
+from anystore.exceptions import DoesNotExist
+from followthemoney import StatementEntity
+from investigraph.cache import get_archive_cache
+from investigraph.logic.load import handle as load
+from investigraph.model import SourceContext
+from investigraph.util import get_func
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+make_state_key = get_func("./extract.py:make_state_key", BASE_PATH)
+
+
+def handle(ctx: SourceContext, proxies: Iterable[StatementEntity]) -> int:
+    ix = load(ctx, proxies)
+    cache = get_archive_cache()
+    try:
+        state = cache.pop(make_state_key(ctx, pending=True), serialization_mode="json")
+    except DoesNotExist:
+        return ix
+    cache.put(make_state_key(ctx), state, serialization_mode="json")
+    ctx.log.info("Stored register state.", entries=len(state))
+    return ix
@@ -1,4 +1,6 @@
+import os
 from enum import Enum
+from typing import Any, Callable
 
 from banal import ensure_dict
 from followthemoney.util import make_entity_id
@@ -6,9 +8,13 @@ from ftmq.util import clean_string, make_fingerprint, get_country_code
 from investigraph.exceptions import DataError
 from investigraph.model import SourceContext, TaskContext
 from investigraph.types import CEGenerator, Record
-from investigraph.util import join_text, make_fingerprint_id
+from investigraph.util import get_func, join_text, make_fingerprint_id
 from nomenklatura.entity import CE
 
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+make_ids_key = get_func("./extract.py:make_ids_key", BASE_PATH)
+
 
 class EntityType(Enum):
     NATURAL = "Person"
@@ -17,6 +23,29 @@ class EntityType(Enum):
 
 DEFAULT_COUNTRY = {"code": "de"}
 
+# ministries, laws and membership organizations are referenced by many
+# registrations: build and emit them only once per run (natural key -> entity id)
+REFERENCES: dict[tuple[str, str], str] = {}
+# the context of the run the references were built in
+RUN: SourceContext | None = None
+# ids of the references used by the current record
+USED: set[str] = set()
+
+
+def emit_reference(
+    context: TaskContext,
+    key: tuple[str, str],
+    func: Callable[..., CE],
+    *args: Any,
+) -> str:
+    """Emit the entity built by `func` if `key` wasn't seen yet, return its id"""
+    if key not in REFERENCES:
+        proxy = func(context, *args)
+        context.emit(proxy)
+        REFERENCES[key] = proxy.id
+    USED.add(REFERENCES[key])
+    return REFERENCES[key]
+
 
 def make_address(context: TaskContext, data: Record) -> CE:
     proxy = context.make_proxy("Address")
@@ -166,21 +195,25 @@ def make_organization(context: TaskContext, proxy: CE, data: Record) -> CE:
             context.emit(rel)
 
     for membership in data.pop("memberships", []):
-        org = context.make_proxy("Organization")
         name = membership.pop("membership")
-        org.id = context.make_slug("org", make_fingerprint_id(name))
-        org.add("name", name)
-        context.emit(org)
+        org_id = emit_reference(context, ("org", name), make_membership_org, name)
 
         rel = context.make_proxy("Membership")
-        rel.id = context.make_slug("membership", make_entity_id(proxy.id, org.id))
-        rel.add("organization", org)
+        rel.id = context.make_slug("membership", make_entity_id(proxy.id, org_id))
+        rel.add("organization", org_id)
         rel.add("member", proxy)
         context.emit(rel)
 
     return proxy
 
 
+def make_membership_org(context: TaskContext, name: str) -> CE:
+    proxy = context.make_proxy("Organization")
+    proxy.id = context.make_slug("org", make_fingerprint_id(name))
+    proxy.add("name", name)
+    return proxy
+
+
 def make_ministry(context: TaskContext, data: Record) -> CE:
     ident = data.pop("shortTitle")
     proxy = context.make_proxy("PublicBody")
@@ -231,12 +264,13 @@ def make_bill(context: TaskContext, data: Record, project: CE, org: CE) -> CE:
     context.emit(participant)
 
     for ministry in data.pop("leadingMinistries"):
-        participant = make_ministry(context, ministry)
-        context.emit(participant)
+        ministry_id = emit_reference(
+            context, ("ministry", ministry["shortTitle"]), make_ministry, ministry
+        )
         rel = context.make_proxy("ProjectParticipant")
-        rel.id = context.make_id("bill-participant", proxy.id, participant.id)
+        rel.id = context.make_id("bill-participant", proxy.id, ministry_id)
         rel.add("project", proxy)
-        rel.add("participant", participant)
+        rel.add("participant", ministry_id)
         rel.add("sourceUrl", ministry.get("draftBillProjectUrl"))
         rel.add("sourceUrl", ministry.get("draftBillDocumentUrl"))
         context.emit(rel)
@@ -259,7 +293,7 @@ def make_project(context: TaskContext, data: Record, org: CE) -> CE:
     context.emit(rel)
 
     for law in data.pop("affectedLaws", []):
-        context.emit(make_law(context, law, proxy))
+        emit_reference(context, ("law", law["shortTitle"]), make_law, law, proxy)
 
     if data.pop("draftBillPresent", []):
         context.emit(make_bill(context, data.pop("draftBill"), proxy, org))
@@ -283,12 +317,16 @@ def make_project(context: TaskContext, data: Record, org: CE) -> CE:
             rel.add("role", "printed_matter")
             context.emit(rel)
             for ministry in matter.pop("leadingMinistries"):
-                ministry = make_ministry(context, ministry)
-                context.emit(ministry)
+                ministry_id = emit_reference(
+                    context,
+                    ("ministry", ministry["shortTitle"]),
+                    make_ministry,
+                    ministry,
+                )
                 rel = context.make_proxy("Documentation")
-                rel.id = context.make_id("matter", doc.id, ministry.id)
+                rel.id = context.make_id("matter", doc.id, ministry_id)
                 rel.add("document", doc)
-                rel.add("entity", ministry)
+                rel.add("entity", ministry_id)
                 rel.add("role", "leading_ministry")
                 context.emit(rel)
 
@@ -413,18 +451,17 @@ def parse_record(context: TaskContext, data: Record):
         "notes", [i["de"] for i in activities.pop("typesOfExercisingLobbyWork", [])]
     )
     proxy.add("sourceUrl", record.pop("detailsPageUrl"))
-    proxy.add("sourceUrl", record.pop("pdfUrl"))
-    proxy.add(
-        "status",
-        "active" if data["accountDetails"]["activeLobbyist"] else "inactive",  # noqa
-    )
+    proxy.add("sourceUrl", record.pop("pdfUrl", None))
+    account = ensure_dict(data.get("accountDetails"))
+    proxy.add("status", "active" if account.get("activeLobbyist") else "inactive")
 
     context.emit(proxy)
 
-    if data["donators"].get("donatorsInformationPresent"):
-        start_date = data["donators"].get("relatedFiscalYearStart")
-        end_date = data["donators"].get("relatedFiscalYearEnd")
-        for item in data["donators"].pop("donators"):
+    donators = ensure_dict(data.get("donators"))
+    if donators.get("donatorsInformationPresent"):
+        start_date = donators.get("relatedFiscalYearStart")
+        end_date = donators.get("relatedFiscalYearEnd")
+        for item in donators.pop("donators", []):
             payer = context.make_proxy("LegalEntity")
             name = item.pop("name")
             payer.id = context.make_slug(
@@ -449,8 +486,8 @@ def parse_record(context: TaskContext, data: Record):
             payment.add("amountEur", amounts["to"])
             context.emit(payment)
 
-    if data["clientIdentity"] and data["clientIdentity"].get("clientsPresent"):
-        clients = data.pop("clientIdentity")
+    clients = ensure_dict(data.pop("clientIdentity", None))
+    if clients.get("clientsPresent"):
         for client in clients.pop("clientOrganizations", []):
             org = init_organization(context, client)
             org = make_organization(context, org, client)
@@ -465,20 +502,23 @@ def parse_record(context: TaskContext, data: Record):
                 rel = make_representation(context, proxy, person)
                 context.emit(rel)
 
-    if data["contracts"] and data["contracts"].pop("contractsPresent"):
-        for contract in data.pop("contracts").pop("contracts"):
+    contracts = ensure_dict(data.pop("contracts", None))
+    if contracts.pop("contractsPresent", False):
+        for contract in contracts.pop("contracts", []):
             context.emit(make_contract(context, contract, proxy))
 
-    if data["statements"] and data["statements"].pop("statementsPresent"):
-        for statement in data.pop("statements").pop("statements"):
+    statements = ensure_dict(data.pop("statements", None))
+    if statements.pop("statementsPresent", False):
+        for statement in statements.pop("statements", []):
             context.emit(make_statement(context, statement, proxy))
 
-    for project in ensure_dict(data.pop("regulatoryProjects")).pop(
+    for project in ensure_dict(data.pop("regulatoryProjects", None)).pop(
         "regulatoryProjects", []
     ):
         context.emit(make_project(context, project, proxy))
 
-    for payment in data.pop("publicAllowances").pop("publicAllowances", []):
+    allowances = ensure_dict(data.pop("publicAllowances", None))
+    for payment in allowances.pop("publicAllowances", []):
         payer = context.make_proxy("PublicBody")
         payer_name = payment.pop("name")
         payer.id = context.make_slug(payer_name)
@@ -502,6 +542,16 @@ def parse_record(context: TaskContext, data: Record):
 
 
 def handle(ctx: SourceContext, record: Record, ix: int) -> CEGenerator:
+    global RUN
+    if ctx is not RUN:
+        # a new run in the same process, its references need to be emitted again
+        REFERENCES.clear()
+        RUN = ctx
+    register_number = record.get("registerNumber")
+    USED.clear()
     tx = ctx.task()
     parse_record(tx, record)
+    # the entity ids of the entry for the incremental state (see `./extract.py`)
+    ids = sorted(USED.union(tx.proxies))
+    ctx.cache.put(make_ids_key(ctx, register_number), ids, serialization_mode="json")
     yield from tx
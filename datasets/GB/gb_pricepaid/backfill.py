@@ -0,0 +1,270 @@
+"""
+Build the entities from the complete price paid history, with the yearly files
+(`pp-YYYY.csv`) as independent partitions transformed in a pool of worker
+processes, and apply the monthly updates on top:
+
+    python backfill.py backfill -j 8
+    python backfill.py update
+
+Each partition is written as runs of transaction fragments sorted by
+transaction id. These are sort-merged (the latest fragments of a transaction
+win, `recordStatus` D removes them) into a compacted base file, and the
+fragments are then sort-merged by entity id into the aggregated entities
+(`entities.ftm.json`, sorted by id). An update only merges the entities of the
+changed transactions again and replaces them in the former entities. Only one
+run of `PRICEPAID_RUN_SIZE` fragments is held in memory at a time.
+
+The workers only read from the shared GB entity index (so they don't wait for
+each others writes), the ids of new addresses are added after the merge.
+"""
+
+import heapq
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import groupby, islice
+from operator import itemgetter
+from pathlib import Path
+from typing import Annotated, Any, Generator, Iterable
+
+import orjson
+import pandas as pd
+import typer
+from anystore.io import smart_open
+from anystore.logging import get_logger
+from followthemoney import model
+from investigraph.model.context import get_dataset_context
+from investigraph.util import get_func
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+CONFIG_URI = os.path.join(BASE_PATH, "config.yml")
+WORKDIR = os.path.join(BASE_PATH, "backfill")
+PARTITION_URL = "https://price-paid-data.publicdata.landregistry.gov.uk/pp-{year}.csv"
+FIRST_YEAR = 1995
+BATCH_SIZE = 100_000
+# fragments sorted in memory per run file
+RUN_SIZE = int(os.environ.get("PRICEPAID_RUN_SIZE", 200_000))
+
+add_ids = get_func("../index.py:add_ids", BASE_PATH)
+make_address_key = get_func("../index.py:make_address_key", BASE_PATH)
+transform_batch = get_func("./extract.py:transform_batch", BASE_PATH)
+iter_records = get_func("./extract.py:iter_records", BASE_PATH)
+handle = get_func("./transform.py:handle", BASE_PATH)
+
+log = get_logger(f"investigraph.datasets.gb_pricepaid.{__name__}")
+
+cli = typer.Typer()
+
+# (transaction id, sequence, record status, entity)
+Fragment = tuple[str, int, str, dict[str, Any]]
+
+
+def write_run(path: Path, lines: Iterable[Any]) -> None:
+    with open(path, "wb") as fh:
+        for line in lines:
+            fh.write(orjson.dumps(line) + b"\n")
+
+
+def read_run(path: Path) -> Generator[Any, None, None]:
+    with open(path, "rb") as fh:
+        for line in fh:
+            yield orjson.loads(line)
+
+
+def merge_runs(paths: Iterable[Path], key=itemgetter(0)) -> Generator[Any, None, None]:
+    yield from heapq.merge(*(read_run(path) for path in paths), key=key)
+
+
+def transform_partition(config_uri: str, uri: str, name: str, seq: int, workdir: str):
+    """Transform a csv file into sorted runs of transaction fragments"""
+    ctx = next(get_dataset_context(config_uri).get_sources())
+    options = ctx.source.pandas.read.options
+    path = Path(workdir) / "tx"
+    rows = 0
+    with smart_open(uri, "rb") as fh:
+        batches = pd.read_csv(fh, **options, dtype=str, chunksize=BATCH_SIZE)
+        for ix, df in enumerate(batches):
+            records = iter_records(transform_batch(ctx, df, read_only=True))
+            fragments = [
+                (tx, seq, status, proxy.to_dict())
+                for tx, status, record in zip(df["id"], df["recordStatus"], records)
+                for proxy in handle(ctx, record, 0)
+            ]
+            fragments.sort(key=itemgetter(0, 1))
+            write_run(path / f"{name}-{ix:05d}.jsonl", fragments)
+            rows += len(df)
+    log.info("Transformed partition.", partition=name, rows=rows)
+    return rows
+
+
+def compact(workdir: Path, seq: int | None = None) -> set[str]:
+    """
+    Sort-merge the base and the new runs by transaction id and write the latest
+    fragments of each transaction (unless it was deleted) as the new base.
+    Returns the ids of the entities of the transactions changed in run `seq`.
+    """
+    base = workdir / "base.jsonl"
+    runs = sorted((workdir / "tx").glob("*.jsonl"))
+    paths = [base, *runs] if base.exists() else runs
+    fragments = merge_runs(paths, key=itemgetter(0, 1))
+    tmp = workdir / "base.jsonl.tmp"
+    changed = set()
+    with open(tmp, "wb") as fh:
+        for _, group in groupby(fragments, key=itemgetter(0)):
+            tx: list[Fragment] = list(group)
+            latest = [f for f in tx if f[1] == tx[-1][1]]
+            if latest[0][1] == seq:
+                changed.update(f[3]["id"] for f in tx)
+            if latest[0][2] == "D":
+                continue
+            for fragment in latest:
+                fh.write(orjson.dumps(fragment) + b"\n")
+    os.replace(tmp, base)
+    for run in runs:
+        run.unlink()
+    return changed
+
+
+def merge_entities(
+    workdir: Path, ids: set[str] | None
+) -> Generator[dict[str, Any], None, None]:
+    """
+    Sort-merge the fragments of the base (only the ones of the given entity
+    ids) by entity id into entities
+    """
+    path = workdir / "entities"
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    runs = []
+    fragments = (
+        (f[3]["id"], f[3])
+        for f in read_run(workdir / "base.jsonl")
+        if ids is None or f[3]["id"] in ids
+    )
+    while batch := sorted(islice(fragments, RUN_SIZE), key=itemgetter(0)):
+        runs.append(path / f"{len(runs):05d}.jsonl")
+        write_run(runs[-1], batch)
+    for _, group in groupby(merge_runs(runs), key=itemgetter(0)):
+        proxy = None
+        for _, data in group:
+            fragment = model.get_proxy(data)
+            proxy = fragment if proxy is None else proxy.merge(fragment)
+        yield proxy.to_dict()
+    shutil.rmtree(path)
+
+
+def aggregate(workdir: Path, ids: set[str] | None) -> int:
+    """
+    Write the entities (sorted by id) to `entities.ftm.json` in the workdir.
+    With `ids`, only these entities are merged again and replace (or remove)
+    the ones of the former file.
+    """
+    path = workdir / "entities.ftm.json"
+    entities = merge_entities(workdir, ids)
+    if ids is not None:
+        former = (e for e in read_run(path) if e["id"] not in ids)
+        entities = heapq.merge(former, entities, key=itemgetter("id"))
+    tmp = workdir / "entities.ftm.json.tmp"
+    count = 0
+    with open(tmp, "wb") as fh:
+        for data in entities:
+            fh.write(orjson.dumps(data) + b"\n")
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def index_addresses(workdir: Path, ids: set[str] | None) -> int:
+    """
+    Add the ids of the (new) addresses to the shared GB index, which the
+    workers only read from
+    """
+    addresses = (
+        (make_address_key(data["properties"]["full"][0]), data["id"])
+        for data in read_run(workdir / "entities.ftm.json")
+        if data["schema"] == "Address" and (ids is None or data["id"] in ids)
+    )
+    return add_ids("address", addresses)
+
+
+def run_partitions(
+    partitions: list[tuple[str, str, int]], workdir: Path, workers: int
+) -> int:
+    (workdir / "tx").mkdir(parents=True, exist_ok=True)
+    # don't inherit open handles (e.g. the GB entity index)
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=mp_context) as pool:
+        futures = [
+            pool.submit(transform_partition, CONFIG_URI, uri, name, seq, str(workdir))
+            for uri, name, seq in partitions
+        ]
+        return sum(future.result() for future in futures)
+
+
+def merge(workdir: Path, out_uri: str | None, rows: int, seq: int | None) -> None:
+    ids = compact(workdir, seq)
+    if seq is None or not (workdir / "entities.ftm.json").exists():
+        ids = None
+    entities = aggregate(workdir, ids)
+    addresses = index_addresses(workdir, ids)
+    if out_uri:
+        with open(workdir / "entities.ftm.json", "rb") as fh:
+            with smart_open(out_uri, "wb") as out:
+                shutil.copyfileobj(fh, out)
+    log.info(
+        "Merged partitions.",
+        rows=rows,
+        merged=len(ids) if ids is not None else entities,
+        entities=entities,
+        addresses=addresses,
+        out=out_uri or workdir / "entities.ftm.json",
+    )
+
+
+@cli.callback()
+def main():
+    """Price paid history backfill"""
+
+
+@cli.command("backfill")
+def backfill(
+    workers: Annotated[int, typer.Option("-j")] = os.cpu_count() or 1,
+    start: Annotated[int, typer.Option()] = FIRST_YEAR,
+    end: Annotated[int, typer.Option()] = date.today().year,
+    workdir: Annotated[Path, typer.Option("-w")] = Path(WORKDIR),
+    out_uri: Annotated[str | None, typer.Option("-o")] = None,
+):
+    """Transform the yearly files in parallel (replacing the base) and merge them"""
+    (workdir / "base.jsonl").unlink(missing_ok=True)
+    shutil.rmtree(workdir / "tx", ignore_errors=True)
+    partitions = [
+        (PARTITION_URL.format(year=year), f"pp-{year}", 0)
+        for year in range(start, end + 1)
+    ]
+    rows = run_partitions(partitions, workdir, workers)
+    merge(workdir, out_uri, rows, None)
+
+
+@cli.command("update")
+def update(
+    uri: Annotated[str | None, typer.Argument()] = None,
+    workdir: Annotated[Path, typer.Option("-w")] = Path(WORKDIR),
+    out_uri: Annotated[str | None, typer.Option("-o")] = None,
+):
+    """
+    Apply a monthly update file (default: the source of the config) on top of
+    the base and merge the changed entities
+    """
+    ctx = get_dataset_context(CONFIG_URI)
+    uri = uri or ctx.config.extract.sources[0].uri
+    seq = int(time.time())
+    partitions = [(uri, f"pp-update-{seq}", seq)]
+    rows = run_partitions(partitions, workdir, 1)
+    merge(workdir, out_uri, rows, seq)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,142 @@
+"""
+Compare the batch transform (`extract.transform_batch` + `transform.handle`)
+against the previous per row implementation on generated price paid rows:
+
+    python bench_transform.py
+"""
+
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import typer
+
+# don't touch the shared GB entity index
+os.environ["GB_INDEX_DB"] = os.path.join(tempfile.mkdtemp(), "index.db")
+
+from investigraph.model.context import get_dataset_context  # noqa: E402
+from investigraph.util import get_func  # noqa: E402
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+CONFIG_URI = os.path.join(BASE_PATH, "config.yml")
+
+start_run = get_func("../index.py:start_run", BASE_PATH)
+transform_batch = get_func("./extract.py:transform_batch", BASE_PATH)
+iter_records = get_func("./extract.py:iter_records", BASE_PATH)
+handle = get_func("./transform.py:handle", BASE_PATH)
+
+
+def getType(code):
+    # D = Detached, S = Semi-Detached, T = Terraced, F = Flats/Maisonettes, O = Other
+    if code == "D":
+        return "Detached"
+    if code == "S":
+        return "Semi-Detached"
+    if code == "T":
+        return "Terraced"
+    if code == "F":
+        return "Flats/Maisonettes"
+    else:
+        return "Other"
+
+
+def getNew(code):
+    if code == "Y":
+        return "newly built"
+    else:
+        return "not newly built"
+
+
+def handle_row(ctx, record, ix):
+    proxy = ctx.make_proxy("RealEstate")
+    address = f"{record['houseNumber']} {record['street']}, {record['locality']}, {record['city']} {record['postalCode']}, {record['district']}, {record['county']}, Great Britain"
+    proxy.id = ctx.make_fingerprint_id(address)
+    proxy.add("address", address)
+    if record["unit"] and record["unit"] != "":
+        proxy.add("description", record["unit"])
+    proxy.add(
+        "propertyType",
+        f"{getType(record['propertyType'])}, {getNew(record['newlyBuilt'])}",
+    )
+    proxy.add("amount", record["amount"])
+    proxy.add("createDate", record["createDate"])
+    proxy.add("country", "gb")
+    proxy.add("currency", "GBP")
+    proxy.add("tenure", "Leasehold" if record["tenure"] == "L" else "Freehold")
+    proxy.add(
+        "sourceUrl",
+        f"https://landregistry.data.gov.uk/data/ppi/transaction/{record['id'][1:-1]}/current",
+    )
+    yield proxy
+
+
+def make_frame(size: int) -> pd.DataFrame:
+    """Random rows, some of them for the same property"""
+    streets = [f"Street {i}" for i in range(size // 10 or 1)]
+    return pd.DataFrame(
+        {
+            "id": [f"{{{i:08X}-0000-0000-0000-000000000000}}" for i in range(size)],
+            "amount": [str(random.randint(10_000, 2_000_000)) for _ in range(size)],
+            "createDate": ["2024-01-31 00:00"] * size,
+            "postalCode": [f"AB{random.randint(1, 99)} 1CD" for _ in range(size)],
+            "propertyType": random.choices("DSTFO", k=size),
+            "newlyBuilt": random.choices("YN", k=size),
+            "tenure": random.choices("FL", k=size),
+            "houseNumber": [str(random.randint(1, 20)) for _ in range(size)],
+            "unit": random.choices([np.nan, "FLAT 1", "FLAT 2"], k=size),
+            "street": random.choices(streets, k=size),
+            "locality": random.choices([np.nan, "Locality"], k=size),
+            "city": ["LONDON"] * size,
+            "district": ["CAMDEN"] * size,
+            "county": ["GREATER LONDON"] * size,
+            "recordType": ["A"] * size,
+            "recordStatus": ["A"] * size,
+        },
+        dtype=object,
+    )
+
+
+def run_rows(ctx, df: pd.DataFrame) -> list:
+    # the former extract stage (investigraph pandas handler) and transform
+    return [
+        proxy
+        for ix, (_, row) in enumerate(df.iterrows(), 1)
+        for proxy in handle_row(ctx, dict(row.replace(np.nan, None)), ix)
+    ]
+
+
+def run_batch(ctx, df: pd.DataFrame) -> list:
+    return [
+        proxy
+        for ix, record in enumerate(iter_records(transform_batch(ctx, df)), 1)
+        for proxy in handle(ctx, record, ix)
+    ]
+
+
+def main(size: int = 100_000):
+    ctx = next(get_dataset_context(CONFIG_URI).get_sources())
+    start_run(ctx.dataset, "bench")
+    df = make_frame(size)
+    results = {}
+    # the second batch run finds the address ids in the (then warm) GB index
+    for name, func in (
+        ("per row", run_rows),
+        ("batch", run_batch),
+        ("batch, indexed", run_batch),
+    ):
+        start = time.perf_counter()
+        results[name] = func(ctx, df)
+        seconds = time.perf_counter() - start
+        print(f"{name:16} {size / seconds:12,.0f} rows/s")
+    # the batch transform additionally emits (and references) the addresses
+    real_estates = [p for p in results["batch"] if p.schema.is_a("RealEstate")]
+    for a, b in zip(results["per row"], real_estates, strict=True):
+        b.pop("addressEntity")
+        assert a.to_dict() == b.to_dict(), (a.to_dict(), b.to_dict())
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,170 @@
+"""
+Read the price paid csv in batches and compute the (cleaned) values of the
+RealEstate entities as whole column operations, so that the transform stage
+only needs to materialize the proxies.
+
+The addresses get their ids from the entity index shared with gb_ccod and
+gb_ocod (by their normalized text, see `../index.py`) and are emitted as
+`Address` entities once per run.
+"""
+
+import os
+import time
+
+import pandas as pd
+from followthemoney import model
+from investigraph.model import SourceContext
+from investigraph.types import RecordGenerator
+from investigraph.util import get_func
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+BATCH_SIZE = 100_000
+# D = Detached, S = Semi-Detached, T = Terraced, F = Flats/Maisonettes, O = Other
+PROPERTY_TYPES = {
+    "D": "Detached",
+    "S": "Semi-Detached",
+    "T": "Terraced",
+    "F": "Flats/Maisonettes",
+}
+SOURCE_URL = "https://landregistry.data.gov.uk/data/ppi/transaction/"
+SCHEMA = model.get("RealEstate")
+ADDRESS = model.get("Address")
+ADDRESS_PARTS = ["unit", "houseNumber", "street", "locality", "city", "postalCode"]
+
+get_ids = get_func("../index.py:get_ids", BASE_PATH)
+lookup_many = get_func("../index.py:lookup_many", BASE_PATH)
+make_address_key = get_func("../index.py:make_address_key", BASE_PATH)
+start_run = get_func("../index.py:start_run", BASE_PATH)
+
+
+def make_address(df: pd.DataFrame) -> pd.Series:
+    # missing parts become "None" as they did in the former per row f-string,
+    # the entity ids are fingerprints of this address
+    df = df.fillna("None")
+    return (
+        df["houseNumber"]
+        + " "
+        + df["street"]
+        + ", "
+        + df["locality"]
+        + ", "
+        + df["city"]
+        + " "
+        + df["postalCode"]
+        + ", "
+        + df["district"]
+        + ", "
+        + df["county"]
+        + ", Great Britain"
+    )
+
+
+def make_ids(ctx: SourceContext, addresses: pd.Series) -> pd.Series:
+    """Fingerprint each address once"""
+    ids = {address: ctx.make_fingerprint_id(address) for address in addresses.unique()}
+    return addresses.map(ids)
+
+
+def make_address_ids(
+    ctx: SourceContext, df: pd.DataFrame, read_only: bool = False
+) -> pd.DataFrame:
+    """
+    Look up the address entities in the shared GB index (once per address),
+    `address_new` is set for the first row of an address new in this run. With
+    `read_only`, the index isn't written to and `address_new` is set for the
+    first row of each address in the batch.
+    """
+    # stacking drops the missing parts
+    full = df[ADDRESS_PARTS].stack().groupby(level=0).agg(", ".join)
+    full = full.reindex(df.index)
+    keys = full.map(
+        {value: make_address_key(value) for value in full.dropna().unique()}
+    )
+    unique = keys.dropna().unique()
+    if read_only:
+        indexed = get_ids("address", unique)
+        ids = {
+            key: (indexed.get(key) or ctx.make_id("address", key), True)
+            for key in unique
+        }
+    else:
+        ids = lookup_many(
+            ctx.dataset, "address", unique, lambda key: ctx.make_id("address", key)
+        )
+    return pd.DataFrame(
+        {
+            "address_id": keys.map({k: v[0] for k, v in ids.items()}),
+            "address_new": keys.map({k: v[1] for k, v in ids.items()}).eq(True)
+            & ~keys.duplicated(),
+            "address_full": clean_values("full", full, ADDRESS),
+            "address_postalCode": clean_values("postalCode", df["postalCode"], ADDRESS),
+            "address_city": clean_values("city", df["city"], ADDRESS),
+        }
+    )
+
+
+def clean_values(prop: str, values: pd.Series, schema=SCHEMA) -> pd.Series:
+    """Clean each distinct value once"""
+    prop_type = schema.get(prop).type
+    cleaned = {value: prop_type.clean(value) for value in values.dropna().unique()}
+    return values.map(cleaned)
+
+
+def transform_batch(
+    ctx: SourceContext, df: pd.DataFrame, read_only: bool = False
+) -> pd.DataFrame:
+    """
+    Compute the RealEstate properties (and the entity id) for a batch, see
+    `make_address_ids` for `read_only`
+    """
+    address = make_address(df)
+    property_type = (
+        df["propertyType"].map(PROPERTY_TYPES).fillna("Other")
+        + ", "
+        + df["newlyBuilt"].map({"Y": "newly built"}).fillna("not newly built")
+    )
+    real_estate = pd.DataFrame(
+        {
+            "entity_id": make_ids(ctx, address),
+            "address": clean_values("address", address),
+            "description": clean_values("description", df["unit"]),
+            "propertyType": clean_values("propertyType", property_type),
+            "amount": clean_values("amount", df["amount"]),
+            "createDate": clean_values("createDate", df["createDate"]),
+            "tenure": clean_values(
+                "tenure", df["tenure"].map({"L": "Leasehold"}).fillna("Freehold")
+            ),
+            # the transaction id is a guid, no need to clean the url
+            "sourceUrl": SOURCE_URL + df["id"].str[1:-1] + "/current",
+        }
+    )
+    return pd.concat([real_estate, make_address_ids(ctx, df, read_only)], axis=1)
+
+
+def start_source_run(ctx: SourceContext) -> str:
+    """Start the GB entity index run for the version of the source file"""
+    info = ctx.source.info()
+    return start_run(ctx.dataset, str(info.cache_key or info.size))
+
+
+def iter_records(df: pd.DataFrame) -> RecordGenerator:
+    columns = list(df.columns)
+    df = df.astype(object).where(df.notna(), None)
+    for row in df.itertuples(index=False, name=None):
+        yield dict(zip(columns, row))
+
+
+def handle(ctx: SourceContext, *args, **kwargs) -> RecordGenerator:
+    options = ctx.source.pandas.read.options
+    start_source_run(ctx)
+    rows = 0
+    start = time.perf_counter()
+    with ctx.open() as fh:
+        for df in pd.read_csv(fh, **options, dtype=str, chunksize=BATCH_SIZE):
+            yield from iter_records(transform_batch(ctx, df))
+            rows += len(df)
+            ctx.log.info(
+                "Extracted batch.",
+                rows=rows,
+                rows_per_sec=round(rows / (time.perf_counter() - start)),
+            )
@@ -1,46 +1,55 @@
+import os
+
+import pandas as pd
 from investigraph.model import SourceContext
 from investigraph.types import Record
+from investigraph.util import get_func
 
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
 
-def getType(code):
-    # D = Detached, S = Semi-Detached, T = Terraced, F = Flats/Maisonettes, O = Other
-    if code == "D":
-        return "Detached"
-    if code == "S":
-        return "Semi-Detached"
-    if code == "T":
-        return "Terraced"
-    if code == "F":
-        return "Flats/Maisonettes"
-    else:
-        return "Other"
+transform_batch = get_func("./extract.py:transform_batch", BASE_PATH)
+iter_records = get_func("./extract.py:iter_records", BASE_PATH)
+start_source_run = get_func("./extract.py:start_source_run", BASE_PATH)
 
+# the values are computed and cleaned per batch in the extract stage (see
+# `./extract.py`)
+PROPERTIES = (
+    "address",
+    "description",
+    "propertyType",
+    "amount",
+    "createDate",
+    "tenure",
+    "sourceUrl",
+)
 
-def getNew(code):
-    if code == "Y":
-        return "newly built"
-    else:
-        return "not newly built"
+# sources with a started GB entity index run (for raw csv rows)
+RUNS: set[str] = set()
 
 
 def handle(ctx: SourceContext, record: Record, ix: int):
+    if "entity_id" not in record:
+        # a raw csv row (e.g. from the default extract handler), compute its
+        # values as a batch of one
+        if ctx.source.name not in RUNS:
+            start_source_run(ctx)
+            RUNS.add(ctx.source.name)
+        df = pd.DataFrame([record], dtype=str)
+        record = next(iter_records(transform_batch(ctx, df)))
     proxy = ctx.make_proxy("RealEstate")
-    address = f"{record['houseNumber']} {record['street']}, {record['locality']}, {record['city']} {record['postalCode']}, {record['district']}, {record['county']}, Great Britain"
-    proxy.id = ctx.make_fingerprint_id(address)
-    proxy.add("address", address)
-    if record["unit"] and record["unit"] != "":
-        proxy.add("description", record["unit"])
-    proxy.add(
-        "propertyType",
-        f"{getType(record['propertyType'])}, {getNew(record['newlyBuilt'])}",
-    )
-    proxy.add("amount", record["amount"])
-    proxy.add("createDate", record["createDate"])
-    proxy.add("country", "gb")
-    proxy.add("currency", "GBP")
-    proxy.add("tenure", "Leasehold" if record["tenure"] == "L" else "Freehold")
-    proxy.add(
-        "sourceUrl",
-        f"https://landregistry.data.gov.uk/data/ppi/transaction/{record['id'][1:-1]}/current",
-    )
+    proxy.id = record["entity_id"]
+    for prop in PROPERTIES:
+        proxy.add(prop, record[prop], cleaned=True)
+    proxy.add("country", "gb", cleaned=True)
+    proxy.add("currency", "GBP", cleaned=True)
+    proxy.add("addressEntity", record["address_id"], cleaned=True)
     yield proxy
+    # the address is shared with gb_ccod and gb_ocod, emitted once per run
+    if record["address_new"]:
+        address = ctx.make_proxy("Address")
+        address.id = record["address_id"]
+        address.add("full", record["address_full"], cleaned=True)
+        address.add("postalCode", record["address_postalCode"], cleaned=True)
+        address.add("city", record["address_city"], cleaned=True)
+        address.add("country", "gb", cleaned=True)
+        yield address
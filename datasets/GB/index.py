@@ -0,0 +1,229 @@
+"""
+On-disk index (natural key -> entity id) shared by the GB Land Registry
+datasets, so that ids are computed (fingerprinted) once, the same address gets
+the same id in all datasets, and reference entities (proprietor companies,
+addresses) are emitted once per run.
+
+It is a sqlite database (in WAL mode), so that the concurrently running
+datasets and their worker processes can write to it.
+
+A run is identified by the dataset and the version of its resource (see
+`start_run`), so that all processes of a run share it. Ids that were not used
+by any run for `GB_INDEX_TTL` days are expired.
+"""
+
+import atexit
+import os
+import sqlite3
+import time
+from functools import cache
+from itertools import islice
+from typing import Any, Callable, Iterable
+
+from anystore.logging import get_logger
+from normality import normalize
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+INDEX_DB = os.environ.get("GB_INDEX_DB", os.path.join(BASE_PATH, "index.db"))
+TTL = int(os.environ.get("GB_INDEX_TTL", 90)) * 86400  # days
+# keep write transactions short for concurrent processes
+COMMIT_INTERVAL = 1  # seconds
+# only touch the last use of an id once per day
+TOUCH_INTERVAL = 86400
+# keys per query in `lookup_many` (below the sqlite variable limit)
+CHUNK_SIZE = 500
+
+# dataset -> current run, for this process
+RUNS: dict[str, str] = {}
+
+last_commit = time.monotonic()
+
+log = get_logger(f"investigraph.datasets.gb.{__name__}")
+
+
+@cache
+def get_db() -> sqlite3.Connection:
+    con = sqlite3.connect(INDEX_DB, timeout=60, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=OFF")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS entity_ids (namespace TEXT, key TEXT, id TEXT, "
+        "used_at REAL, PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+    )
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS seen_keys (run TEXT, namespace TEXT, key TEXT, "
+        "PRIMARY KEY (run, namespace, key)) WITHOUT ROWID"
+    )
+    con.execute("CREATE TABLE IF NOT EXISTS runs (dataset TEXT PRIMARY KEY, run TEXT)")
+    con.commit()
+    atexit.register(con.commit)
+    log.info("Opened entity index.", uri=INDEX_DB)
+    return con
+
+
+def make_address_key(*parts: Any) -> str | None:
+    """The normalized address text, the key for addresses in all datasets"""
+    return normalize(" ".join(str(p) for p in parts if p)) or None
+
+
+def start_run(dataset: str, version: str) -> str:
+    """
+    Start (or restart) the run for the version of the datasets resource: forget
+    the keys seen by the previous (or an incomplete) run of the dataset and
+    expire unused ids
+    """
+    run = f"{dataset}:{version}"
+    db = get_db()
+    db.commit()
+    db.execute(
+        "DELETE FROM seen_keys WHERE run = ? OR run IN "
+        "(SELECT run FROM runs WHERE dataset = ?)",
+        (run, dataset),
+    )
+    db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (dataset, run))
+    expired = db.execute(
+        "DELETE FROM entity_ids WHERE used_at < ?", (time.time() - TTL,)
+    ).rowcount
+    db.commit()
+    RUNS[dataset] = run
+    log.info("Started entity index run.", run=run, expired=expired)
+    return run
+
+
+def get_run(dataset: str) -> str:
+    if dataset not in RUNS:
+        res = (
+            get_db()
+            .execute("SELECT run FROM runs WHERE dataset = ?", (dataset,))
+            .fetchone()
+        )
+        if res is None:
+            raise ValueError(f"No entity index run started for `{dataset}`")
+        RUNS[dataset] = res[0]
+    return RUNS[dataset]
+
+
+def _get_db() -> sqlite3.Connection:
+    """The connection, with the pending writes committed once per interval"""
+    global last_commit
+    db = get_db()
+    if db.in_transaction and time.monotonic() - last_commit > COMMIT_INTERVAL:
+        db.commit()
+        last_commit = time.monotonic()
+    return db
+
+
+def lookup(
+    dataset: str, namespace: str, key: str, make_id: Callable[[], str]
+) -> tuple[str, bool]:
+    """
+    Get the id for the key (computed via `make_id` only if it isn't indexed yet)
+    and whether the key is seen the first time in the current run of the dataset
+    """
+    run = get_run(dataset)
+    db = _get_db()
+    now = time.time()
+    res = db.execute(
+        "SELECT id, used_at FROM entity_ids WHERE namespace = ? AND key = ?",
+        (namespace, key),
+    ).fetchone()
+    if res is None:
+        # another process might have indexed the key meanwhile, its id wins
+        db.execute(
+            "INSERT OR IGNORE INTO entity_ids VALUES (?, ?, ?, ?)",
+            (namespace, key, make_id(), now),
+        )
+        entity_id = db.execute(
+            "SELECT id FROM entity_ids WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()[0]
+    else:
+        entity_id, used_at = res
+        if now - used_at > TOUCH_INTERVAL:
+            db.execute(
+                "UPDATE entity_ids SET used_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key),
+            )
+    is_new = db.execute(
+        "INSERT OR IGNORE INTO seen_keys VALUES (?, ?, ?)", (run, namespace, key)
+    ).rowcount
+    return entity_id, bool(is_new)
+
+
+def _select_ids(
+    db: sqlite3.Connection, namespace: str, keys: list[str]
+) -> dict[str, tuple[str, float]]:
+    params = ", ".join("?" * len(keys))
+    res = db.execute(
+        "SELECT key, id, used_at FROM entity_ids "
+        f"WHERE namespace = ? AND key IN ({params})",
+        (namespace, *keys),
+    )
+    return {key: (entity_id, used_at) for key, entity_id, used_at in res}
+
+
+def lookup_many(
+    dataset: str, namespace: str, keys: Iterable[str], make_id: Callable[[str], str]
+) -> dict[str, tuple[str, bool]]:
+    """
+    `lookup` for many (distinct) keys with a few queries per chunk of keys
+    instead of a few per key, `make_id` gets the key
+    """
+    run = get_run(dataset)
+    keys = iter(keys)
+    result = {}
+    while chunk := list(islice(keys, CHUNK_SIZE)):
+        db = _get_db()
+        now = time.time()
+        indexed = _select_ids(db, namespace, chunk)
+        missing = [key for key in chunk if key not in indexed]
+        if missing:
+            # another process might have indexed keys meanwhile, its ids win
+            db.executemany(
+                "INSERT OR IGNORE INTO entity_ids VALUES (?, ?, ?, ?)",
+                [(namespace, key, make_id(key), now) for key in missing],
+            )
+            indexed.update(_select_ids(db, namespace, missing))
+        db.executemany(
+            "UPDATE entity_ids SET used_at = ? WHERE namespace = ? AND key = ?",
+            [
+                (now, namespace, key)
+                for key, (_, used_at) in indexed.items()
+                if now - used_at > TOUCH_INTERVAL
+            ],
+        )
+        values = ", ".join("(?, ?, ?)" for _ in chunk)
+        new = {
+            key
+            for (key,) in db.execute(
+                f"INSERT INTO seen_keys VALUES {values} "
+                "ON CONFLICT DO NOTHING RETURNING key",
+                [value for key in chunk for value in (run, namespace, key)],
+            )
+        }
+        for key in chunk:
+            result[key] = (indexed[key][0], key in new)
+    return result
+
+
+def get_ids(namespace: str, keys: Iterable[str]) -> dict[str, str]:
+    """The indexed ids for the keys, without writing to the index"""
+    keys = iter(keys)
+    result = {}
+    while chunk := list(islice(keys, CHUNK_SIZE)):
+        indexed = _select_ids(get_db(), namespace, chunk)
+        result.update((key, entity_id) for key, (entity_id, _) in indexed.items())
+    return result
+
+
+def add_ids(namespace: str, ids: Iterable[tuple[str, str]]) -> int:
+    """Index the (key, id) pairs that are not indexed yet, in one transaction"""
+    db = get_db()
+    db.commit()
+    now = time.time()
+    added = db.executemany(
+        "INSERT OR IGNORE INTO entity_ids VALUES (?, ?, ?, ?)",
+        ((namespace, key, entity_id, now) for key, entity_id in ids),
+    ).rowcount
+    db.commit()
+    return added
@@ -0,0 +1,25 @@
+"""
+Export handler of gb_ccod and gb_ocod.
+
+Export with the default handler only if the run loaded a resource (see
+`./load.py`): a run that skipped an already processed resource writes
+nothing, so that the published entities are not replaced.
+"""
+
+from ftmq.model import Dataset
+from investigraph.logic.export import handle as export
+from investigraph.model import DatasetContext
+
+
+def make_loaded_key(ctx: DatasetContext) -> str:
+    """Runtime cache key marking the current run as loaded"""
+    return f"{ctx.dataset}/loaded"
+
+
+def handle(ctx: DatasetContext, *args, **kwargs) -> Dataset:
+    key = make_loaded_key(ctx)
+    if not ctx.cache.exists(key):
+        ctx.log.info("No data exported as the resource was already processed.")
+        return ctx.config.dataset
+    ctx.cache.delete(key)
+    return export(ctx, *args, **kwargs)
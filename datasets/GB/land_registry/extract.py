@@ -0,0 +1,189 @@
+"""
+Extract handler of gb_ccod and gb_ocod.
+
+Extract the current "Full File" of the dataset or, with
+`LAND_REGISTRY_CHANGE_ONLY=1`, the monthly "Change Only File" on top of an
+already loaded full file. Resources that were already processed (same file
+name, size and checksum, stored in the archive cache) are skipped: nothing is
+extracted, and the export stage (`./export.py`) writes nothing, as with
+investigraph's extract cache, so that the published entities are not replaced
+with an empty file.
+
+The processed resource is stored as pending when the extraction is complete,
+and only becomes the state for the next run once the load stage has finished
+(`./load.py`), so that a failed load is repeated by the next run.
+
+The change only mode requires the persistent statement store (`load.uri`) the
+full file was loaded into. Titles marked as deleted (`Change Indicator` D, a
+changed title is a deletion and an addition) are retracted from it before the
+added titles are passed on.
+"""
+
+from investigraph.cache import get_archive_cache
+from investigraph.model import SourceContext
+from investigraph.types import RecordGenerator
+from anystore.exceptions import DoesNotExist
+from anystore.util import make_checksum
+from investigraph.util import get_func
+from typing import Any
+import requests
+import zipfile
+import os
+import csv
+import io
+import tempfile
+import time
+
+CHUNK_SIZE = 1024 * 1024
+LOG_INTERVAL = 100_000
+CHANGE_ONLY = os.environ.get("LAND_REGISTRY_CHANGE_ONLY", "").lower() in ("1", "true")
+RESOURCE = "Change Only File" if CHANGE_ONLY else "Full File"
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+get_mapping = get_func("./transform.py:get_mapping", BASE_PATH)
+start_run = get_func("../index.py:start_run", BASE_PATH)
+
+
+def make_state_key(ctx: SourceContext, pending: bool | None = False) -> str:
+    key = f"{ctx.dataset}/resources/{RESOURCE}"
+    if pending:
+        return f"{key}.pending.json"
+    return f"{key}.json"
+
+
+def get_state(ctx: SourceContext) -> dict[str, Any]:
+    """The last processed resource"""
+    try:
+        return get_archive_cache().get(make_state_key(ctx), serialization_mode="json")
+    except DoesNotExist:
+        return {}
+
+
+def download(lnk: str, path: str) -> None:
+    """Stream the response body to `path` in chunks"""
+    with requests.get(lnk, stream=True) as response:
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+
+
+def read_csv(ctx: SourceContext, path: str, member: str) -> RecordGenerator:
+    """
+    Read the csv member directly from the zip archive without extracting it,
+    building one record per row with empty values as `None`
+    """
+    # time spent reading (not in the following stages)
+    elapsed = 0.0
+    with zipfile.ZipFile(path, "r") as arch:
+        with arch.open(member) as fh:
+            reader = csv.reader(io.TextIOWrapper(fh, encoding="utf-8", newline=""))
+            header = next(reader)
+            ix = 0
+            while True:
+                start = time.perf_counter()
+                row = next(reader, None)
+                if row is None:
+                    return
+                record = dict(zip(header, [value or None for value in row]))
+                elapsed += time.perf_counter() - start
+                yield record
+                ix += 1
+                if ix % LOG_INTERVAL == 0:
+                    ctx.log.info(
+                        "Read csv rows.", rows=ix, rows_per_sec=round(ix / elapsed)
+                    )
+
+
+def retract(ctx: SourceContext, records: RecordGenerator) -> int:
+    """
+    Remove the RealEstate entities of the given titles and the Ownerships
+    referencing them from the statement store. Companies and addresses can be
+    shared with other titles and are kept.
+    """
+    ids = set()
+    for record in records:
+        for ix, query in enumerate(ctx.config.transform.queries):
+            mapping = get_mapping(ix, query, record)
+            if mapping is not None:
+                for proxy in mapping.map(record).values():
+                    if proxy.schema.is_a("RealEstate"):
+                        ids.add(proxy.id)
+    view = ctx.store.default_view()
+    retracted = 0
+    with ctx.store.writer() as writer:
+        for entity_id in ids:
+            for _, entity in list(view.get_inverted(entity_id)):
+                if entity.schema.is_a("Ownership"):
+                    writer.pop(entity.id)
+                    retracted += 1
+            if writer.pop(entity_id):
+                retracted += 1
+    ctx.log.info("Retracted deleted titles.", titles=len(ids), entities=retracted)
+    return retracted
+
+
+def handle(ctx: SourceContext) -> RecordGenerator:
+    if CHANGE_ONLY and ctx.config.load.uri.startswith("memory"):
+        raise ValueError(
+            "Change only mode requires the persistent statement store "
+            "(`load.uri`) the full file was loaded into"
+        )
+    uri = ctx.source.uri
+    headers = {
+        "Authorization": f"{os.getenv('GB_OCOD_KEY')}",
+        "Accept": "application/json",
+    }
+    res = requests.get(uri, headers=headers)
+    data = res.json()
+    resource = next(
+        f for f in data["result"].get("resources") if f["name"] == RESOURCE
+    )
+    resource_name = resource["file_name"]
+    state = get_state(ctx)
+    # the file name encodes the month of the release
+    if (
+        state.get("file_name") == resource_name
+        and state.get("file_size") == resource.get("file_size")
+    ):
+        ctx.log.info("Skipping already processed resource.", **state)
+        return
+    resource_link = (
+        requests.get(f"{uri}/{resource_name}", headers=headers)
+        .json()
+        .get("result", {})
+        .get("download_url")
+    )
+    # per run directory, so that concurrent runs don't overwrite each other
+    with tempfile.TemporaryDirectory(prefix=f"{ctx.dataset}-") as tmp:
+        path = os.path.join(tmp, resource_name)
+        download(resource_link, path)
+        with open(path, "rb") as fh:
+            checksum = make_checksum(fh)
+        if state.get("checksum") == checksum:
+            ctx.log.info("Skipping unchanged resource.", **state)
+            return
+        start_run(ctx.dataset, checksum)
+        member = f"{os.path.splitext(resource_name)[0]}.csv"
+        if CHANGE_ONLY:
+            # retract all deletions first, a changed title is deleted and added
+            deleted = (
+                r
+                for r in read_csv(ctx, path, member)
+                if r.get("Change Indicator") == "D"
+            )
+            retract(ctx, deleted)
+        for record in read_csv(ctx, path, member):
+            if CHANGE_ONLY and record.get("Change Indicator") == "D":
+                continue
+            yield record
+
+    state = {
+        "file_name": resource_name,
+        "file_size": resource.get("file_size"),
+        "checksum": checksum,
+    }
+    get_archive_cache().put(
+        make_state_key(ctx, pending=True), state, serialization_mode="json"
+    )
+    ctx.log.info("Extracted resource.", **state)
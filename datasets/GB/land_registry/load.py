@@ -0,0 +1,36 @@
+"""
+Load handler of gb_ccod and gb_ocod.
+
+Write the proxies to the statement store with the default handler, and only
+afterwards promote the processed resource of the extraction (see
+`./extract.py`) and mark the run as loaded for the export stage (see
+`./export.py`). A run that skipped its resource has nothing to promote.
+"""
+
+import os
+from typing import Iterable
+
+from anystore.exceptions import DoesNotExist
+from followthemoney import StatementEntity
+from investigraph.cache import get_archive_cache
+from investigraph.logic.load import handle as load
+from investigraph.model import SourceContext
+from investigraph.util import get_func
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+make_state_key = get_func("./extract.py:make_state_key", BASE_PATH)
+make_loaded_key = get_func("./export.py:make_loaded_key", BASE_PATH)
+
+
+def handle(ctx: SourceContext, proxies: Iterable[StatementEntity]) -> int:
+    ix = load(ctx, proxies)
+    cache = get_archive_cache()
+    try:
+        state = cache.pop(make_state_key(ctx, pending=True), serialization_mode="json")
+    except DoesNotExist:
+        return ix
+    cache.put(make_state_key(ctx), state, serialization_mode="json")
+    ctx.cache.put(make_loaded_key(ctx), True)
+    ctx.log.info("Stored processed resource.", **state)
+    return ix
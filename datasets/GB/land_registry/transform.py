@@ -0,0 +1,145 @@
+"""
+Transform handler of gb_ccod and gb_ocod.
+
+Execute the `transform.queries` of the config with compiled mappings that only
+contain the entities a record has keys for. Most titles have only one or two
+proprietors, and the empty `companyN` / `ownerN` entities would otherwise be
+evaluated (and logged as skipped) for each row.
+
+Proprietor companies and addresses are emitted only once per run, using the
+entity index shared by the GB datasets (see `../index.py`).
+
+The mappings are applied per record: evaluating them over pandas batches
+instead was not faster than the compiled row mapping.
+"""
+
+import os
+import time
+from typing import Generator
+
+from followthemoney import StatementEntity, model
+from followthemoney.mapping.query import QueryMapping
+from followthemoney.proxy import EntityProxy
+from followthemoney.types import registry
+from ftmq.util import make_entity
+from investigraph.model import SourceContext
+from investigraph.model.mapping import QueryMapping as QueryConfig
+from investigraph.types import CEGenerator, Record
+from investigraph.util import get_func
+from normality import stringify
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+LOG_INTERVAL = 100_000
+
+lookup = get_func("../index.py:lookup", BASE_PATH)
+make_address_key = get_func("../index.py:make_address_key", BASE_PATH)
+
+# (query index, skipped entities) -> compiled mapping
+MAPPINGS: dict[tuple[int, frozenset[str]], QueryMapping | None] = {}
+# time spent in this stage (not in extracting or loading)
+ELAPSED = 0.0
+
+
+def get_skipped(query: QueryConfig, record: Record) -> frozenset[str]:
+    """The entities of the query that can't get an id from the record"""
+    skipped = set()
+    for name, entity in query.entities.items():
+        keys = [entity.id_column] if entity.id_column else entity.keys
+        if not any(stringify(record.get(key)) for key in keys):
+            skipped.add(name)
+    return frozenset(skipped)
+
+
+def compile_mapping(query: QueryConfig, skipped: frozenset[str]) -> QueryMapping | None:
+    """
+    Compile the query without the skipped entities, the entities that require
+    them and the properties referencing them
+    """
+    data = query.model_dump(by_alias=True)
+    entities = data["entities"]
+    skipped = set(skipped)
+    size = None
+    while size != len(skipped):
+        size = len(skipped)
+        for name, entity in entities.items():
+            for prop in entity["properties"].values():
+                if prop["required"] and prop["entity"] in skipped:
+                    skipped.add(name)
+    entities = {
+        name: {
+            **entity,
+            "properties": {
+                key: prop
+                for key, prop in entity["properties"].items()
+                if prop["entity"] not in skipped
+            },
+        }
+        for name, entity in entities.items()
+        if name not in skipped
+    }
+    if not entities:
+        return
+    data["entities"] = entities
+    data["csv_url"] = "/dev/null"
+    return model.make_mapping(data)
+
+
+def get_mapping(ix: int, query: QueryConfig, record: Record) -> QueryMapping | None:
+    key = (ix, get_skipped(query, record))
+    if key not in MAPPINGS:
+        MAPPINGS[key] = compile_mapping(query, key[1])
+    return MAPPINGS[key]
+
+
+def dedupe(
+    ctx: SourceContext, record: Record, entities: dict[str, EntityProxy]
+) -> Generator[EntityProxy, None, None]:
+    """
+    Skip proprietor companies and addresses already emitted in this run.
+    Companies with a registration number (for the country of incorporation)
+    and addresses (by their normalized text, shared with gb_pricepaid) get the
+    id they were first indexed with, references are rewritten to that id.
+    """
+    ids, skipped = {}, set()
+    for name, proxy in entities.items():
+        key = proxy.id
+        if proxy.schema.is_a("Company"):
+            namespace = "company"
+            registration_number = proxy.first("registrationNumber")
+            if registration_number:
+                country = proxy.first("country") or "gb"
+                key = f"{country}:{registration_number}"
+        elif proxy.schema.is_a("Address"):
+            namespace = "address"
+            key = make_address_key(record.get("Property Address")) or key
+        else:
+            continue
+        ids[proxy.id], is_new = lookup(ctx.dataset, namespace, key, lambda: proxy.id)
+        if not is_new:
+            skipped.add(name)
+    for name, proxy in entities.items():
+        if name in skipped:
+            continue
+        proxy.id = ids.get(proxy.id, proxy.id)
+        for prop in list(proxy.iterprops()):
+            if prop.type == registry.entity:
+                proxy.set(prop, [ids.get(i, i) for i in proxy.get(prop)])
+        yield proxy
+
+
+def handle(ctx: SourceContext, record: Record, ix: int) -> CEGenerator:
+    global ELAPSED
+    start = time.perf_counter()
+    proxies = []
+    for query_ix, query in enumerate(ctx.config.transform.queries):
+        mapping = get_mapping(query_ix, query, record)
+        if mapping is not None and mapping.source.check_filters(record):
+            for proxy in dedupe(ctx, record, mapping.map(record)):
+                proxy = make_entity(proxy.to_dict(), StatementEntity, ctx.dataset)
+                proxies.append(proxy)
+    ELAPSED += time.perf_counter() - start
+    if ix % LOG_INTERVAL == 0:
+        ctx.log.info(
+            "Transformed records.", rows=ix, rows_per_sec=round(ix / ELAPSED)
+        )
+    yield from proxies
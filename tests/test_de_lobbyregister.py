@@ -0,0 +1,127 @@
+import os
+from pathlib import Path
+
+import orjson
+import pytest
+
+# read when the handlers are loaded
+os.environ["LOBBYREGISTER_INCREMENTAL"] = "1"
+
+from investigraph.cache import get_archive_cache  # noqa: E402
+from investigraph.model import DatasetContext  # noqa: E402
+from investigraph.model.config import get_config  # noqa: E402
+from investigraph.model.source import Source  # noqa: E402
+
+REGISTER_URL = "https://www.lobbyregister.bundestag.de"
+CONFIG_URI = (
+    Path(__file__).parent.parent / "datasets" / "DE" / "de_lobbyregister" / "config.yml"
+)
+
+
+def make_record(register_number: str, version: int, **details) -> dict:
+    return {
+        "registerNumber": register_number,
+        "registerEntryDetails": {
+            "version": version,
+            "validFromDate": f"2024-01-0{version}",
+            "detailsPageUrl": f"{REGISTER_URL}/{register_number}",
+            "pdfUrl": None,
+            **details,
+        },
+        "lobbyistIdentity": {
+            "identity": "ORGANIZATION",
+            "name": f"Verband {register_number}",
+            "namedEmployees": [],
+        },
+        "activitiesAndInterests": {
+            "activity": "Interessenvertretung",
+            "activityDescription": "Beschreibung",
+            "fieldsOfInterest": [],
+        },
+        "accountDetails": {"activeLobbyist": True},
+        "donators": {},
+        "clientIdentity": None,
+        "contracts": None,
+        "statements": None,
+        "regulatoryProjects": None,
+        "publicAllowances": {},
+    }
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    monkeypatch.setenv("INVESTIGRAPH_ARCHIVE_URI", str(tmp_path / "archive"))
+    monkeypatch.setenv("INVESTIGRAPH_EXTRACT_CACHE", "0")
+    get_archive_cache.cache_clear()
+    path = tmp_path / "register.json"
+
+    def _run(*records: dict) -> DatasetContext:
+        path.write_bytes(orjson.dumps({"results": records}))
+        config = get_config(CONFIG_URI).model_copy(deep=True)
+        config.extract.sources = [Source(name="register", uri=str(path))]
+        config.load.uri = f"sqlite:///{tmp_path / 'store.db'}"
+        ctx = DatasetContext(config=config)
+        for sctx in ctx.get_sources():
+            sctx.load(sctx.transform(sctx.extract()))
+        return ctx
+
+    yield _run
+    get_archive_cache.cache_clear()
+
+
+def get_entities(ctx: DatasetContext) -> dict[str, dict]:
+    return {e.id: e.to_dict() for e in ctx.store.iterate()}
+
+
+def test_incremental_retracts_former_versions(run):
+    pdf_url = f"{REGISTER_URL}/R000001-v1.pdf"
+    first = make_record("R000001", 1, pdfUrl=pdf_url)
+    first["lobbyistIdentity"]["namedEmployees"] = [
+        {"firstName": "Erika", "lastName": "Mustermann"}
+    ]
+    withdrawn = make_record("R000002", 1)
+    entities = get_entities(run(first, withdrawn))
+    org_id = "de-bt-lr-r000001"
+    assert pdf_url in entities[org_id]["properties"]["sourceUrl"]
+    assert "de-bt-lr-r000002" in entities
+    assert any(e["schema"] == "Employment" for e in entities.values())
+
+    # the new version has no pdf and no employees, the other entry is withdrawn
+    entities = get_entities(run(make_record("R000001", 2)))
+    assert pdf_url not in entities[org_id]["properties"]["sourceUrl"]
+    assert "de-bt-lr-r000002" not in entities
+    assert not any(e["schema"] in ("Employment", "Person") for e in entities.values())
+
+    # an unchanged entry isn't transformed again and stays in the store
+    assert get_entities(run(make_record("R000001", 2))) == entities
+
+
+def test_minimal_record(run):
+    # a record without any of the optional sections
+    record = make_record("R000003", 1)
+    for key in (
+        "accountDetails",
+        "donators",
+        "clientIdentity",
+        "contracts",
+        "statements",
+        "regulatoryProjects",
+        "publicAllowances",
+    ):
+        del record[key]
+    del record["registerEntryDetails"]["pdfUrl"]
+    entities = get_entities(run(record))
+    assert entities["de-bt-lr-r000003"]["properties"]["status"] == ["inactive"]
+
+
+def test_references_per_run(run):
+    first = make_record("R000004", 1)
+    first["lobbyistIdentity"]["memberships"] = [{"membership": "Dachverband"}]
+    second = make_record("R000004", 2)
+    second["lobbyistIdentity"]["memberships"] = [{"membership": "Dachverband"}]
+    run(first)
+    # the new version retracts the membership organization, so the next run
+    # needs to emit it again
+    entities = get_entities(run(second))
+    names = [e["properties"].get("name") for e in entities.values()]
+    assert ["Dachverband"] in names
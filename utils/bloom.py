@@ -0,0 +1,58 @@
+import hashlib
+import math
+import struct
+from typing import Self
+
+HEADER = struct.Struct(">QI")
+
+
+class BloomFilter:
+    """
+    A simple bloom filter over string keys. A negative lookup is exact, a
+    positive lookup needs to be confirmed by the caller.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1_000_000,
+        error_rate: float = 0.01,
+        size: int | None = None,
+        num_hashes: int | None = None,
+        bits: bytes | None = None,
+    ) -> None:
+        self.size = size or math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.num_hashes = num_hashes or max(
+            1, round(self.size / capacity * math.log(2))
+        )
+        self.bits = bytearray(bits or math.ceil(self.size / 8))
+
+    def _positions(self, key: str) -> list[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack(">QQ", digest)
+        return [(h1 + i * h2) % self.size for i in range(self.num_hashes)]
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key)
+        )
+
+    def update(self, other: "BloomFilter") -> None:
+        """Merge another filter with the same dimensions into this one"""
+        if (other.size, other.num_hashes) != (self.size, self.num_hashes):
+            raise ValueError("Cannot merge bloom filters of different dimensions")
+        merged = int.from_bytes(self.bits, "big") | int.from_bytes(other.bits, "big")
+        self.bits = bytearray(merged.to_bytes(len(self.bits), "big"))
+
+    def to_bytes(self) -> bytes:
+        return HEADER.pack(self.size, self.num_hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Self:
+        size, num_hashes = HEADER.unpack_from(data)
+        return cls(size=size, num_hashes=num_hashes, bits=data[HEADER.size :])
@@ -1,34 +1,55 @@
-from typing import Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from typing import Any, Iterable
 from urllib.parse import urlparse, urlunparse
 
-import requests
+import httpx
+from anystore.exceptions import DoesNotExist
 from anystore.store import get_store
 from banal import is_mapping
 from memorious.logic.context import Context
 from servicelayer import env
+from structlog import get_logger
 
 from utils import Data
 
+log = get_logger(__name__)
+
 CACHE_PREFIX = env.get("MEMORIOUS_CACHE_PREFIX", "memorious")
 CACHE = get_store()
 
+# last-known http status per url, revalidated after this many seconds
+STATUS_TTL = env.to_int("MEMORIOUS_STATUS_TTL", 86400)
+STATUS_WORKERS = env.to_int("MEMORIOUS_STATUS_WORKERS", 8)
+
 
 def make_cache_key(context: Context, key: str) -> str | None:
     prefix = context.crawler.name
     return f"{CACHE_PREFIX}/{prefix}/{key}"
 
 
+def ensure_url(url: str | dict[str, Any] | None) -> str | None:
+    if is_mapping(url):
+        url = url.get("url")
+    return url or None
+
+
 def make_url_cache_key(
     context: Context, url: str | dict[str, Any] | None, *args, **kwargs
 ) -> str | None:
-    if is_mapping(url):
-        url = url["url"]
+    """
+    Compute the cache key for an url without any network request. Urls with an
+    unknown or erroneous last-known status are not cached, use
+    `revalidate_urls` beforehand to update the status index.
+    """
+    url = ensure_url(url)
     if not url:
         return
 
     # don't cache error responses
-    res = requests.head(url)
-    if not res.ok:
+    status = get_url_status(url)
+    if not is_ok(status):
         return
 
     url = url.split("//", 1)[1]
@@ -46,3 +67,85 @@ def make_emit_cache_key(context: Context, data: Data) -> str | None:
         return
     cache_key = sanitize_key(cache_key)
     return make_cache_key(context, f"emit/{cache_key}")
+
+
+def make_status_key(url: str) -> str:
+    return f"{CACHE_PREFIX}/status/{sanitize_key(url)}"
+
+
+def get_url_status(url: str) -> Data | None:
+    """Get the last-known response status for an url from the status index"""
+    try:
+        return CACHE.get(make_status_key(url), serialization_mode="json")
+    except DoesNotExist:
+        return None
+
+
+def make_url_status(status: int, headers: Any | None = None) -> Data:
+    headers = headers or {}
+    return {
+        "status": status,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "checked_at": time.time(),
+    }
+
+
+def set_url_status(url: str, status: int, headers: Any | None = None) -> Data:
+    data = make_url_status(status, headers)
+    CACHE.put(make_status_key(url), data, serialization_mode="json")
+    return data
+
+
+def is_ok(status: Data | None) -> bool:
+    return status is not None and 0 < status["status"] < 400
+
+
+def is_stale(status: Data | None) -> bool:
+    return status is None or time.time() - status["checked_at"] > STATUS_TTL
+
+
+def revalidate_url(client: httpx.Client, url: str, status: Data | None) -> Data:
+    headers = {}
+    if is_ok(status):
+        if status["etag"]:
+            headers["If-None-Match"] = status["etag"]
+        if status["last_modified"]:
+            headers["If-Modified-Since"] = status["last_modified"]
+    try:
+        res = client.head(url, headers=headers)
+    except httpx.HTTPError as e:
+        log.warning(f"Cannot revalidate url: `{e.__class__.__name__}: {e}`", url=url)
+        # don't store transport errors, keep the last-known status (if any) and
+        # retry on the next revalidation
+        return status or make_url_status(0)
+    if res.status_code == 304 and status is not None:
+        headers = {"etag": status["etag"], "last-modified": status["last_modified"]}
+        return set_url_status(url, status["status"], {**headers, **res.headers})
+    return set_url_status(url, res.status_code, res.headers)
+
+
+def revalidate_urls(urls: Iterable[str | dict[str, Any] | None]) -> int:
+    """
+    Update the status index for all given urls whose last-known status is
+    missing or older than `MEMORIOUS_STATUS_TTL`. Requests are conditional
+    (ETag / Last-Modified) and run concurrently over a shared connection pool.
+
+    Returns:
+        The number of revalidated urls
+    """
+    stale: dict[str, Data | None] = {}
+    for url in urls:
+        url = ensure_url(url)
+        if url and url not in stale:
+            status = get_url_status(url)
+            if is_stale(status):
+                stale[url] = status
+    if not stale:
+        return 0
+    with httpx.Client() as client:
+        with ThreadPoolExecutor(STATUS_WORKERS) as pool:
+            clients = repeat(client, len(stale))
+            list(pool.map(revalidate_url, clients, stale.keys(), stale.values()))
+    log.info("Revalidated url status.", urls=len(stale))
+    return len(stale)
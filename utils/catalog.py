@@ -1,9 +1,17 @@
-from anystore.io import DoesNotExist, smart_read
-from servicelayer import env
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
 from typing import Any, Generator
-from structlog import get_logger
+
 import yaml
 from anystore import get_store, smart_write
+from anystore.decorators import error_handler
+from anystore.io import DoesNotExist, smart_read
+from anystore.model import Stats
+from anystore.util import make_data_checksum
+from servicelayer import env
+from structlog import get_logger
 
 log = get_logger(__name__)
 
@@ -11,6 +19,9 @@ log = get_logger(__name__)
 DATASETS = get_store("datasets", serialization_mode="raw")
 LEAKRFC_URI = env.get("LEAKRFC_URI", "s3://investigativecommons")
 PUBLIC_URL = "https://data.investigativecommons.org"
+REGISTRY_URI = env.get("DATASETS_REGISTRY_URI", ".cache/datasets.json")
+PUSH_MANIFEST_URI = f"{LEAKRFC_URI}/.leakrfc/configs.json"
+PUSH_WORKERS = env.to_int("DATASETS_PUSH_WORKERS", 8)
 
 
 def make_config_uri(dataset: str) -> str:
@@ -21,29 +32,131 @@ def make_index_uri(dataset: str) -> str:
     return f"{PUBLIC_URL}/{dataset}/.leakrfc/index.json"
 
 
+def make_version(stats: Stats) -> str:
+    mtime = stats.raw.get("mtime") or stats.updated_at or stats.created_at
+    return f"{mtime}:{stats.size}"
+
+
+class DatasetRegistry:
+    """
+    Compiled index of all local dataset configs (config key -> name, version,
+    checksum, parsed config), persisted as a single json file. On refresh, only
+    configs with a changed version (mtime, size) are read again, and only
+    configs with a changed checksum are parsed again.
+    """
+
+    def __init__(self, uri: str | None = REGISTRY_URI) -> None:
+        self.uri = uri
+        self.entries: dict[str, dict[str, Any]] = {}
+        try:
+            self.entries = json.loads(smart_read(self.uri))
+        except (DoesNotExist, ValueError):
+            pass
+
+    def refresh(self) -> None:
+        entries = {}
+        changed = 0
+        for key in DATASETS.iterate_keys(glob="**/config.yml"):
+            entry = self.entries.get(key)
+            version = make_version(DATASETS.info(key))
+            if entry is None or entry["version"] != version:
+                content = DATASETS.get(key)
+                checksum = make_data_checksum(content)
+                if entry is None or entry["checksum"] != checksum:
+                    config = yaml.safe_load(content)
+                    entry = {"name": config["name"], "config": config}
+                entry = {**entry, "version": version, "checksum": checksum}
+                changed += 1
+            entries[key] = entry
+        if changed or entries.keys() != self.entries.keys():
+            self.entries = entries
+            smart_write(self.uri, json.dumps(self.entries).encode())
+            log.info("Updated dataset registry.", uri=self.uri, changed=changed)
+
+    def __iter__(self) -> Generator[tuple[str, dict[str, Any]], None, None]:
+        for key, entry in self.entries.items():
+            yield key, entry["config"]
+
+    def get(self, name: str) -> tuple[str, dict[str, Any]]:
+        for key, entry in self.entries.items():
+            if entry["name"] == name:
+                return key, entry["config"]
+        raise DoesNotExist(name)
+
+
+@cache
+def get_registry() -> DatasetRegistry:
+    """Get the dataset registry, refreshed once per process"""
+    registry = DatasetRegistry()
+    registry.refresh()
+    return registry
+
+
 def get_datasets() -> Generator[dict[str, Any], None, None]:
     """Iterate through all local dataset configs"""
-    for key in DATASETS.iterate_keys(glob="**/config.yml"):
-        dataset = DATASETS.get(key, deserialization_func=yaml.safe_load)
+    for _, dataset in get_registry():
         yield dataset
 
 
 def get_dataset(name: str) -> dict[str, Any]:
     """Lookup a local dataset config by its name (foreign_id)"""
-    for dataset in get_datasets():
-        if dataset["name"] == name:
-            return dataset
-    raise DoesNotExist(name)
-
-
-def push_dataset_configs(name: str | None = None) -> None:
-    """Push a local dataset config (or all) to the remote storage"""
-    for key in DATASETS.iterate_keys(glob="**/config.yml"):
-        dataset = DATASETS.get(key, deserialization_func=yaml.safe_load)
-        if name and dataset["name"] == name or name is None:
-            uri = make_config_uri(dataset["name"])
-            smart_write(uri, DATASETS.get(key))
-            log.info("Upload complete.", dataset=dataset["name"], uri=uri)
+    _, dataset = get_registry().get(name)
+    return dataset
+
+
+def get_push_manifest() -> dict[str, str]:
+    """Get the checksums of the configs on the remote storage by dataset name"""
+    try:
+        return json.loads(smart_read(PUSH_MANIFEST_URI))
+    except DoesNotExist:
+        return {}
+
+
+@error_handler(logger=log, max_retries=3)
+def push_dataset_config(key: str, name: str) -> bool:
+    uri = make_config_uri(name)
+    smart_write(uri, DATASETS.get(key))
+    log.info("Upload complete.", dataset=name, uri=uri)
+    return True
+
+
+def push_dataset_configs(name: str | None = None, force: bool = False) -> None:
+    """
+    Push a local dataset config (or all) to the remote storage. Configs are
+    compared against the checksums in the remote manifest, only changed configs
+    are uploaded (unless `force`) in a thread pool.
+    """
+    start = time.time()
+    registry = get_registry()
+    entries = registry.entries
+    if name:
+        key, _ = registry.get(name)
+        entries = {key: entries[key]}
+    manifest = get_push_manifest()
+    changed = {
+        key: entry
+        for key, entry in entries.items()
+        if force or manifest.get(entry["name"]) != entry["checksum"]
+    }
+    uploaded = 0
+    with ThreadPoolExecutor(PUSH_WORKERS) as pool:
+        names = [entry["name"] for entry in changed.values()]
+        results = pool.map(push_dataset_config, changed.keys(), names)
+        for entry, result in zip(changed.values(), results):
+            if result:
+                manifest[entry["name"]] = entry["checksum"]
+                uploaded += 1
+    if uploaded:
+        smart_write(PUSH_MANIFEST_URI, json.dumps(manifest).encode())
+    elapsed = time.time() - start
+    log.info(
+        "Push complete.",
+        uploaded=uploaded,
+        skipped=len(entries) - len(changed),
+        failed=len(changed) - uploaded,
+        seconds=round(elapsed, 2),
+        configs_per_second=round(uploaded / elapsed, 2),
+    )
 
 
 def make_catalog(in_uri: str) -> str:
@@ -0,0 +1,239 @@
+"""
+Emit cache key index for memorious crawlers, configured via:
+
+- `MEMORIOUS_EMIT_FILTER_CAPACITY`, `MEMORIOUS_EMIT_FILTER_ERROR_RATE`: bloom
+  filter dimensions (used when a filter is built the first time)
+- `MEMORIOUS_EMIT_FLUSH_SIZE`, `MEMORIOUS_EMIT_FLUSH_INTERVAL`: write buffered
+  keys after this many keys or seconds
+"""
+
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from typing import Iterable
+from uuid import uuid4
+
+from anystore.serialize import to_store
+from memorious.logic.context import Context
+from servicelayer import env
+from structlog import get_logger
+
+from utils.bloom import BloomFilter
+from utils.cache import CACHE, CACHE_PREFIX
+
+log = get_logger(__name__)
+
+EMIT_FILTER_CAPACITY = env.to_int("MEMORIOUS_EMIT_FILTER_CAPACITY", 1_000_000)
+EMIT_FILTER_ERROR_RATE = float(env.get("MEMORIOUS_EMIT_FILTER_ERROR_RATE", 0.01))
+# write buffered emit keys after this many keys or seconds
+EMIT_FLUSH_SIZE = env.to_int("MEMORIOUS_EMIT_FLUSH_SIZE", 1_000)
+EMIT_FLUSH_INTERVAL = env.to_int("MEMORIOUS_EMIT_FLUSH_INTERVAL", 30)
+# manifests are kept this long after their keys are written, so that all
+# running processes pick them up; older ones are left over by processes that
+# didn't finish and are written (and removed) by any process
+MANIFEST_RETENTION = timedelta(seconds=2 * EMIT_FLUSH_INTERVAL)
+MANIFEST_STALE = timedelta(seconds=10 * EMIT_FLUSH_INTERVAL)
+
+
+def get_manifest_date(manifest: str) -> datetime:
+    name = manifest.rsplit("/", 1)[-1]
+    return datetime.strptime(name[:14], "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+
+
+class EmitIndex:
+    """
+    Per-crawler index of stored emit cache keys. A bloom filter persisted next
+    to the cache answers most lookups locally, positive hits are confirmed by a
+    single key lookup in the cache (the per-key `emit/...` layout stays the
+    same, so keys written before are found as well).
+
+    New keys are buffered and flushed in bulk as one manifest object per batch
+    of keys, which all processes of the crawler add to their filter when they
+    refresh (periodically, in the background). The keys of a manifest are then
+    written to the cache in the background (on redis directly with pipelined
+    SETs) and the manifest is removed again, so only the manifests of the last
+    flushes are listed. The filter itself is only written (merged into the
+    persisted one) at exit.
+    """
+
+    def __init__(self, crawler: str) -> None:
+        self.crawler = crawler
+        self.prefix = f"{CACHE_PREFIX}/{crawler}/emit"
+        self.filter_key = f"{CACHE_PREFIX}/{crawler}/_filters/emit.bloom"
+        self.manifest_prefix = f"{CACHE_PREFIX}/{crawler}/_manifests/emit"
+        self.use_pipeline = CACHE.scheme == "redis"
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.buffer: list[str] = []
+        self.flushed_at = time.monotonic()
+        # own manifests -> keys not yet written to the cache
+        self.pending: dict[str, set[str]] = {}
+        # own manifests with written keys, removed after the retention time
+        self.written: set[str] = set()
+        # manifests (of any process) already added to the filter
+        self.seen: set[str] = set()
+        self.filter = self.load()
+        self.refresh()
+        atexit.register(self.close)
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def load(self) -> BloomFilter:
+        data = CACHE.get(
+            self.filter_key, raise_on_nonexist=False, serialization_mode="raw"
+        )
+        if data:
+            return BloomFilter.from_bytes(data)
+        # first run: build the filter from the already stored keys
+        bloom = BloomFilter(EMIT_FILTER_CAPACITY, EMIT_FILTER_ERROR_RATE)
+        ix = 0
+        for ix, key in enumerate(CACHE.iterate_keys(prefix=self.prefix), 1):
+            bloom.add(key)
+        log.info("Built emit filter.", crawler=self.crawler, keys=ix)
+        self.save(bloom)
+        return bloom
+
+    def save(self, bloom: BloomFilter) -> None:
+        """Merge the given filter into the persisted one and write it back"""
+        data = CACHE.get(
+            self.filter_key, raise_on_nonexist=False, serialization_mode="raw"
+        )
+        with self.lock:
+            if data:
+                bloom.update(BloomFilter.from_bytes(data))
+            data = bloom.to_bytes()
+        CACHE.put(self.filter_key, data, serialization_mode="raw")
+
+    def refresh(self) -> None:
+        """
+        Add the keys of the manifests flushed (by any process) since the last
+        refresh to the filter and write the keys of left over manifests
+        """
+        now = datetime.now(timezone.utc)
+        current = set(CACHE.iterate_keys(prefix=self.manifest_prefix))
+        for manifest in current - self.seen:
+            keys = CACHE.get(
+                manifest, raise_on_nonexist=False, serialization_mode="json"
+            )
+            with self.lock:
+                for key in keys or []:
+                    self.filter.add(key)
+            if (
+                keys is not None
+                and manifest not in self.pending
+                and now - get_manifest_date(manifest) > MANIFEST_STALE
+            ):
+                self._write_keys(keys)
+                CACHE.delete(manifest, ignore_errors=True)
+                log.info("Wrote left over emit keys.", manifest=manifest)
+        with self.lock:
+            self.seen = current
+
+    def exists(self, key: str) -> bool:
+        if key not in self.filter:
+            return False
+        with self.lock:
+            if key in self.buffer:
+                return True
+            if any(key in keys for keys in self.pending.values()):
+                return True
+        return CACHE.exists(key)
+
+    def add(self, key: str) -> None:
+        with self.lock:
+            self.filter.add(key)
+            self.buffer.append(key)
+        if len(self.buffer) >= EMIT_FLUSH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all buffered keys as a manifest to the cache"""
+        with self.flush_lock:
+            with self.lock:
+                keys, self.buffer = self.buffer, []
+                self.flushed_at = time.monotonic()
+            if not keys:
+                return
+            try:
+                manifest = self._write_manifest(keys)
+                if self.use_pipeline:
+                    self._write_keys(keys)
+                    self.written.add(manifest)
+                else:
+                    with self.lock:
+                        self.pending[manifest] = set(keys)
+            except Exception:
+                # keep the keys for the next attempt
+                with self.lock:
+                    self.buffer = keys + self.buffer
+                raise
+            log.info("Flushed emit keys.", crawler=self.crawler, keys=len(keys))
+
+    def write(self) -> None:
+        """
+        Write the keys of the flushed manifests to the cache and remove the
+        manifests after the retention time
+        """
+        with self.write_lock:
+            for manifest, keys in list(self.pending.items()):
+                self._write_keys(keys)
+                with self.lock:
+                    self.pending.pop(manifest, None)
+                    self.written.add(manifest)
+            now = datetime.now(timezone.utc)
+            for manifest in list(self.written):
+                if now - get_manifest_date(manifest) > MANIFEST_RETENTION:
+                    CACHE.delete(manifest, ignore_errors=True)
+                    self.written.discard(manifest)
+
+    def close(self) -> None:
+        """Flush and write the buffered keys and write the filter"""
+        self.flush()
+        self.write()
+        self.save(self.filter)
+
+    def _write_keys(self, keys: Iterable[str]) -> None:
+        if not self.use_pipeline:
+            for key in keys:
+                CACHE.touch(key)
+            return
+        # redis is only installed with the redis cache backend
+        from anystore.store.redis import get_redis
+
+        value = to_store(datetime.now(), CACHE.serialization_mode)
+        pipe = get_redis(CACHE.uri).pipeline(transaction=False)
+        for key in keys:
+            pipe.set(CACHE.get_key(key), value, ex=CACHE.default_ttl or None)
+        pipe.execute()
+
+    def _write_manifest(self, keys: list[str]) -> str:
+        now = datetime.now(timezone.utc)
+        key = f"{self.manifest_prefix}/{now:%Y%m%d%H%M%S}-{uuid4()}.json"
+        CACHE.put(key, keys, serialization_mode="json")
+        return key
+
+    def _flush_periodically(self) -> None:
+        while True:
+            time.sleep(EMIT_FLUSH_INTERVAL)
+            try:
+                if time.monotonic() - self.flushed_at >= EMIT_FLUSH_INTERVAL:
+                    self.flush()
+                self.write()
+                self.refresh()
+            except Exception as e:
+                log.error(
+                    f"Cannot flush emit keys: `{e.__class__.__name__}: {e}`",
+                    crawler=self.crawler,
+                )
+
+
+@cache
+def _get_emit_index(crawler: str) -> EmitIndex:
+    return EmitIndex(crawler)
+
+
+def get_emit_index(context: Context) -> EmitIndex:
+    """Get the emit index for the current crawler, loaded once per process"""
+    return _get_emit_index(context.crawler.name)
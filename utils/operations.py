@@ -4,7 +4,8 @@ from memorious.logic.context import Context
 from servicelayer import env
 
 from utils import Data, get_method
-from utils.cache import CACHE, make_emit_cache_key
+from utils.cache import make_emit_cache_key
+from utils.emit import get_emit_index
 
 DEBUG = env.to_bool("DEBUG")
 PROXY = env.get("MEMORIOUS_CRAWL_PROXY")
@@ -28,13 +29,14 @@ def init(context: Context, data: Data):
 def cached_emit(context: Context, data: Data, rule: str | None = None):
     """
     Only emit (pass through next stage) if a cache key is not present yet. The
-    cache key will be set in the last (store) stage.
+    cache key will be set in the last (store) stage. Lookups go through the
+    crawlers emit index (see `utils.emit`).
     """
     if not settings.use_cache:
         context.emit(rule or "pass", data=data)
         return
     cache_key = make_emit_cache_key(context, data)
-    if not cache_key or not CACHE.exists(cache_key):
+    if not cache_key or not get_emit_index(context).exists(cache_key):
         context.emit(rule or "pass", data=data)
         return
     context.log.info(f"Skipping emit cache key: `{cache_key}`")
@@ -43,7 +45,7 @@ def cached_emit(context: Context, data: Data, rule: str | None = None):
 def store(context: Context, data: Data):
     """
     An extended store to be able to set the emit cache key after successful
-    store
+    store. The key is buffered and written in bulk by the crawlers emit index.
     """
 
     # FIXME
@@ -52,6 +54,6 @@ def store(context: Context, data: Data):
         handler(context, data)
         cache_key = make_emit_cache_key(context, data)
         if cache_key:
-            CACHE.touch(cache_key)
+            get_emit_index(context).add(cache_key)
     except Exception as e:
         context.log.error(f"Cannot store file: `{e.__class__.__name__}: {e}`")